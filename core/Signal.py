@@ -1,13 +1,69 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, Product
+from .cache import catalog_cache
+from .authentication import user_cache
+from .search import index_products
+from .jobs import enqueue
+
+def cached_profile(user):
+    # Without triggering a query for a profile that wasn't loaded.
+    return User.userprofile.related.get_cached_value(user, None)
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.create(user=instance)
+        # A profile attached before the first save (see RegisterView) is
+        # inserted as is, so the user's profile takes a single write.
+        profile = cached_profile(instance) or UserProfile()
+        profile.user = instance
+        profile.save()
+
+@receiver(post_save, sender=User)
+def save_user_profile(sender, instance, created, **kwargs):
+    profile = cached_profile(instance)
+    if not created and profile is not None and profile.has_changed():
+        profile.save()
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.userprofile.save()
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Evict again on commit in case a concurrent request re-cached the old row.
+    user_cache.invalidate(instance.pk)
+    transaction.on_commit(lambda: user_cache.invalidate(instance.pk))
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_cached_user_profile(sender, instance, **kwargs):
+    user_cache.invalidate(instance.user_id)
+    transaction.on_commit(lambda: user_cache.invalidate(instance.user_id))
+
+@receiver(post_save, sender=Product)
+def invalidate_cached_product(sender, instance, created, update_fields=None, **kwargs):
+    changed = instance.changed_fields()
+    if update_fields is not None:
+        changed &= set(update_fields)
+    lists = created or 'price' in changed
+    search = created or bool(changed & {'name', 'description'})
+    transaction.on_commit(lambda: catalog_cache.invalidate([instance.id], lists=lists, search=search))
+
+@receiver(post_delete, sender=Product)
+def invalidate_deleted_product(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: catalog_cache.invalidate([product_id], lists=True, search=True))
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'name', 'description'} & set(update_fields):
+        return
+    transaction.on_commit(lambda: index_products([instance]))
+
+@receiver(post_save, sender=Product)
+def generate_image_derivatives(sender, instance, **kwargs):
+    if instance.image and instance.image_derivatives.get('source') != instance.image.name:
+        # Queued in the same transaction, so it runs only if the save commits.
+        enqueue('core.images.process_product', {'product_id': instance.id},
+                key='images:%d:%s' % (instance.id, instance.image.name))
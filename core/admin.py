@@ -1,9 +1,33 @@
-from django.contrib import admin
-from .models import UserProfile, Product, Cart, CartItem, Order
+from django.contrib import admin, messages
+from .models import UserProfile, Product, Cart, CartItem, Order, StockReservation
+from .orders import bulk_transition
 
 admin.site.register(UserProfile)
 admin.site.register(Product)
 admin.site.register(Cart)
 admin.site.register(CartItem)
-admin.site.register(Order)
+admin.site.register(StockReservation)
 
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'status', 'total_price', 'created_at']
+    list_filter = ['status']
+    # Status only moves through the actions below, which check transitions.
+    readonly_fields = ['status']
+    actions = ['mark_completed', 'mark_cancelled']
+
+    def transition(self, request, queryset, status):
+        moved = bulk_transition(queryset, status)
+        skipped = queryset.exclude(status=status).count()
+        self.message_user(request, '%d orders marked %s.' % (moved, status))
+        if skipped:
+            self.message_user(request, '%d orders could not move to %s and were left alone.' % (skipped, status), messages.WARNING)
+
+    @admin.action(description='Mark selected orders completed')
+    def mark_completed(self, request, queryset):
+        self.transition(request, queryset, 'completed')
+
+    @admin.action(description='Mark selected orders cancelled')
+    def mark_cancelled(self, request, queryset):
+        self.transition(request, queryset, 'cancelled')
@@ -0,0 +1,108 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler as BaseASGIHandler
+from django.db import close_old_connections
+
+from . import views
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'ASYNC_ORM_WORKERS', 16),
+            thread_name_prefix='orm',
+        )
+    return _executor
+
+
+def _call(view, request, *args, **kwargs):
+    # Executor threads aren't covered by Django's request_started/finished
+    # connection cleanup, so do it around each call.
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        # A streaming body is produced later, by ASGIHandler.send_response().
+        return response
+    finally:
+        close_old_connections()
+
+
+async def run_in_executor(view, request, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Copy the context so per-request metrics still see the queries.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, _call, view, request, *args, **kwargs))
+
+
+def async_read_view(view_class):
+    """
+    Serve safe methods of a sync APIView from the bounded ORM executor, so
+    reads run side by side. Writes keep Django's default sync_to_async
+    path, one at a time on the thread-sensitive executor.
+    """
+    sync_view = view_class.as_view()
+    sync_write = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return await run_in_executor(sync_view, request, *args, **kwargs)
+        return await sync_write(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    view.view_class = view_class
+    return view
+
+
+def _next_part(iterator):
+    try:
+        return next(iterator)
+    except StopIteration:
+        return None
+    finally:
+        close_old_connections()
+
+
+class ASGIHandler(BaseASGIHandler):
+    """
+    Django 3.2's handler iterates streaming bodies on the event loop, where
+    the ORM refuses to run. This one pulls each part from the ORM executor
+    instead, so a streamed response goes out part by part as it is produced.
+    """
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [
+            (header.encode('ascii') if isinstance(header, str) else header,
+             value.encode('latin1') if isinstance(value, str) else value)
+            for header, value in response.items()
+        ]
+        headers += [(b'Set-Cookie', cookie.output(header='').encode('ascii').strip()) for cookie in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        iterator = iter(response)
+        while True:
+            part = await loop.run_in_executor(get_executor(), context.run, _next_part, iterator)
+            if part is None:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+product_list = async_read_view(views.ProductListView)
+product_search = async_read_view(views.ProductSearchView)
+product_detail = async_read_view(views.ProductDetailView)
+cart = async_read_view(views.CartView)
@@ -0,0 +1,112 @@
+import pickle
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from ecommerce.metrics import registry
+from .cache import LRUCache, is_shared
+
+
+class UserCache:
+    """
+    Per-process LRU of users (with their profile) by id.
+
+    Each entry carries the user's version stamp from the shared cache, which
+    invalidate() bumps, and is used only while that stamp is unchanged; so a
+    save or delete in any worker is seen by all of them on their next
+    request, at the cost of one shared-cache read. When the shared cache is
+    process-local, users are loaded from the database every time.
+    """
+    _missing = object()
+
+    def __init__(self):
+        options = getattr(settings, 'AUTH_USER_CACHE', {})
+        self.alias = options.get('CACHE_ALIAS', 'default')
+        self.local = LRUCache(options.get('MAX_ENTRIES', 10000), options.get('TTL', 60))
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def version_key(self, user_id):
+        return 'auth_user:version:%s' % user_id
+
+    def get_version(self, user_id):
+        key = self.version_key(user_id)
+        version = self.shared.get(key)
+        if version is None:
+            # Seed without overwriting a concurrent bump; a lost stamp comes
+            # back with a new value, so no old entry matches it.
+            self.shared.add(key, time.time_ns(), None)
+            version = self.shared.get(key)
+        return version
+
+    def load(self, user_id):
+        User = get_user_model()
+        return User.objects.select_related('userprofile').filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+
+    def get(self, user_id):
+        if not is_shared(self.shared):
+            return self.load(user_id)
+        version = self.get_version(user_id)
+        # Entries are pickled so each request gets its own instances to mutate.
+        # Checking the stamp inside the lookup counts a stale entry as a miss.
+        entry = self.local.get(user_id, valid=lambda entry: entry[0] == version)
+        if entry is not None:
+            return pickle.loads(entry[1])
+        user = self.load(user_id)
+        if user is not None:
+            self.local.set(user_id, (version, pickle.dumps(user)))
+        return user
+
+    def invalidate(self, user_id):
+        self.local.delete(user_id)
+        if is_shared(self.shared):
+            self.shared.set(self.version_key(user_id), time.time_ns(), None)
+
+    def stats(self):
+        return self.local.stats()
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the token's user through user_cache
+    instead of querying for it on every request.
+    """
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = user_cache.get(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+def collect_user_cache_metrics():
+    stats = user_cache.stats()
+    yield 'auth_user_cache_hits_total', {}, stats['hits']
+    yield 'auth_user_cache_misses_total', {}, stats['misses']
+    yield 'auth_user_cache_evictions_total', {}, stats['evictions']
+    yield 'auth_user_cache_entries', {}, stats['entries']
+
+
+registry.describe('auth_user_cache_hits_total', 'counter', 'Authenticated requests whose user came from the cache.')
+registry.describe('auth_user_cache_misses_total', 'counter', 'Authenticated requests that had to load their user.')
+registry.describe('auth_user_cache_evictions_total', 'counter', 'Users evicted from the cache to stay within its bound.')
+registry.describe('auth_user_cache_entries', 'gauge', 'Users in the cache.')
+registry.register_collector(collect_user_cache_metrics)
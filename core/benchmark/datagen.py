@@ -0,0 +1,192 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.cache import catalog_cache
+from core.models import UserProfile, Product, Cart, CartItem, Order, OrderLine
+from core.search import rebuild_index
+
+PASSWORD = 'benchmark-password'
+
+ADJECTIVES = ('black', 'leather', 'wireless', 'classic', 'slim', 'vintage', 'sport', 'waterproof', 'organic', 'smart')
+NOUNS = ('jacket', 'sneakers', 'watch', 'keyboard', 'bottle', 'backpack', 'phone', 'laptop', 'sweater', 'glasses')
+WORDS = ADJECTIVES + NOUNS + ('comfortable', 'durable', 'lightweight', 'premium', 'everyday', 'gift', 'travel', 'office')
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """
+    Let bulk_create keep the timestamps we set on auto_now/auto_now_add fields.
+    """
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field, auto_now, auto_now_add in saved:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def next_id(model):
+    return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+
+class DataGenerator:
+    """
+    Seeded bulk loader for benchmark datasets.
+
+    Primary keys are assigned up front so rows that reference each other can
+    be inserted with bulk_create on every backend, including MySQL, which
+    doesn't return ids from multi-row INSERTs.
+    """
+    def __init__(self, seed=0, batch_size=5000, days=365, log=print):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.days = days
+        self.log = log
+        self.now = timezone.now()
+
+    @contextmanager
+    def timed(self, label, count):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.log('%-10s %10d rows %8.1fs %10.0f rows/s' % (label, count, elapsed, count / elapsed if elapsed else 0))
+
+    def insert(self, model, rows):
+        batch = []
+        count = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                with transaction.atomic():
+                    model.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            count += len(batch)
+        return count
+
+    def past(self):
+        return self.now - timedelta(seconds=self.random.randrange(self.days * 86400))
+
+    def create_users(self, prefix, count, user_type):
+        first_id = next_id(User)
+        password = make_password(PASSWORD)
+        self.insert(User, (
+            User(id=first_id + i, username='%s%d' % (prefix, first_id + i), email='%s%d@example.com' % (prefix, first_id + i), password=password)
+            for i in range(count)
+        ))
+        self.insert(UserProfile, (UserProfile(user_id=first_id + i, user_type=user_type) for i in range(count)))
+        return list(range(first_id, first_id + count))
+
+    def create_products(self, seller_ids, count):
+        first_id = next_id(Product)
+
+        def rows():
+            for i in range(count):
+                name = '%s %s' % (self.random.choice(ADJECTIVES).title(), self.random.choice(NOUNS))
+                yield Product(
+                    id=first_id + i,
+                    name=name,
+                    description=' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(8, 30))),
+                    price=Decimal(self.random.randint(100, 100000)) / 100,
+                    stock=self.random.randint(0, 500),
+                    seller_id=self.random.choice(seller_ids),
+                    updated_at=self.now,
+                )
+        with explicit_timestamps(Product._meta.get_field('updated_at')):
+            self.insert(Product, rows())
+        return first_id, first_id + count
+
+    def create_items(self, first_item_id, product_range, sizes, cart_ids=None):
+        item_id = first_item_id
+        for i, size in enumerate(sizes):
+            # A cart holds each product at most once.
+            for product_id in self.random.sample(range(*product_range), min(size, product_range[1] - product_range[0])):
+                yield CartItem(id=item_id, cart_id=cart_ids[i] if cart_ids else None, product_id=product_id, quantity=self.random.randint(1, 3))
+                item_id += 1
+
+    def create_carts(self, user_ids, product_range, max_items):
+        first_id = next_id(Cart)
+        cart_ids = [first_id + i for i in range(len(user_ids))]
+        sizes = [self.random.randint(0, max_items) for _ in user_ids]
+        self.insert(Cart, (Cart(id=cart_id, user_id=user_id) for cart_id, user_id in zip(cart_ids, user_ids)))
+        self.insert(CartItem, self.create_items(next_id(CartItem), product_range, sizes, cart_ids))
+
+    def create_orders(self, user_ids, product_range, count, max_items):
+        first_id = next_id(Order)
+        first_item_id = next_id(CartItem)
+        sizes = [min(self.random.randint(1, max_items), product_range[1] - product_range[0]) for _ in range(count)]
+        statuses = ['pending', 'completed', 'completed', 'completed', 'cancelled']
+
+        def orders():
+            for i in range(count):
+                created_at = self.past()
+                yield Order(
+                    id=first_id + i,
+                    user_id=self.random.choice(user_ids),
+                    total_price=Decimal(self.random.randint(100, 500000)) / 100,
+                    status=self.random.choice(statuses),
+                    payment_method=self.random.choice(Order.PAYMENT_CHOICES)[0],
+                    created_at=created_at,
+                    updated_at=created_at,
+                )
+        with explicit_timestamps(Order._meta.get_field('created_at'), Order._meta.get_field('updated_at')):
+            self.insert(Order, orders())
+        self.insert(CartItem, self.create_items(first_item_id, product_range, sizes))
+
+        def links():
+            item_id = first_item_id
+            for i, size in enumerate(sizes):
+                for _ in range(size):
+                    yield Order.items.through(order_id=first_id + i, cartitem_id=item_id)
+                    item_id += 1
+        self.insert(Order.items.through, links())
+        self.snapshot_lines(first_id)
+
+    def snapshot_lines(self, first_order_id):
+        Links = Order.items.through
+        last_id = 0
+        while True:
+            links = list(
+                Links.objects.filter(order_id__gte=first_order_id, id__gt=last_id).order_by('id')
+                .values_list('id', 'order_id', 'cartitem__product_id', 'cartitem__product__name',
+                             'cartitem__product__price', 'cartitem__quantity')[:self.batch_size]
+            )
+            if not links:
+                return
+            with transaction.atomic():
+                OrderLine.objects.bulk_create([
+                    OrderLine(order_id=order_id, product_id=product_id, product_name=name, unit_price=price,
+                              quantity=quantity, line_total=price * quantity)
+                    for _, order_id, product_id, name, price, quantity in links
+                ])
+            last_id = links[-1][0]
+
+    def generate(self, sellers, buyers, products, carts, orders, cart_items=5, order_items=5, index=False):
+        with self.timed('sellers', sellers):
+            seller_ids = self.create_users('seller', sellers, 'seller')
+        with self.timed('buyers', buyers):
+            buyer_ids = self.create_users('buyer', buyers, 'buyer')
+        with self.timed('products', products):
+            product_range = self.create_products(seller_ids, products)
+        with self.timed('carts', carts):
+            self.create_carts(buyer_ids[:carts], product_range, cart_items)
+        with self.timed('orders', orders):
+            self.create_orders(buyer_ids, product_range, orders, order_items)
+        if index:
+            with self.timed('search', products):
+                rebuild_index(batch_size=self.batch_size)
+        catalog_cache.invalidate_all()
@@ -0,0 +1,220 @@
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+DEFAULT_MIX = {
+    'browse': 60,
+    'add_to_cart': 20,
+    'checkout': 5,
+    'order_history': 15,
+}
+# Catalog and cart reads only, for comparing serving modes.
+READ_MIX = {
+    'browse': 80,
+    'view_cart': 20,
+}
+SCENARIOS = ('browse', 'view_cart', 'add_to_cart', 'checkout', 'order_history', 'signup')
+SEARCH_TERMS = ('leather', 'jacket', 'watch', 'wireless sneakers', 'black', 'bottle', 'smart phone')
+
+
+class Client:
+    """
+    Minimal keep-alive HTTP client; one per virtual user.
+    """
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=timeout)
+        self.prefix = parts.path.rstrip('/')
+        self.token = None
+
+    def request(self, method, path, data=None):
+        headers = {'Accept': 'application/json'}
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers['Content-Type'] = 'application/json'
+        if self.token:
+            headers['Authorization'] = 'Bearer %s' % self.token
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            return 0, None, time.perf_counter() - start
+        elapsed = time.perf_counter() - start
+        try:
+            payload = json.loads(content) if content else None
+        except ValueError:
+            payload = None
+        return response.status, payload, elapsed
+
+    def close(self):
+        self.connection.close()
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, endpoint, status, elapsed):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if not 200 <= status < 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+class VirtualUser:
+    def __init__(self, client, recorder, rng, username, password, product_ids):
+        self.client = client
+        self.recorder = recorder
+        self.random = rng
+        self.username = username
+        self.password = password
+        self.product_ids = product_ids
+
+    def call(self, endpoint, method, path, data=None):
+        status, payload, elapsed = self.client.request(method, path, data)
+        self.recorder.record(endpoint, status, elapsed)
+        return status, payload
+
+    def login(self):
+        status, payload = self.call('login', 'POST', '/api/auth/login/', {'username': self.username, 'password': self.password})
+        if status == 200:
+            self.client.token = payload['access']
+        return status == 200
+
+    def browse(self):
+        status, payload = self.call('product-list', 'GET', '/api/products/?page_size=20')
+        if status == 200 and payload.get('next') and self.random.random() < 0.3:
+            next_url = urlsplit(payload['next'])
+            self.call('product-list', 'GET', '%s?%s' % (next_url.path, next_url.query))
+        self.call('product-detail', 'GET', '/api/products/%d/' % self.random.choice(self.product_ids))
+        if self.random.random() < 0.5:
+            self.call('product-search', 'GET', '/api/products/search/?q=%s' % self.random.choice(SEARCH_TERMS).replace(' ', '+'))
+
+    def add_to_cart(self):
+        self.call('add-to-cart', 'POST', '/api/cart/add/', {'product_id': self.random.choice(self.product_ids), 'quantity': 1})
+        self.call('cart', 'GET', '/api/cart/')
+
+    def view_cart(self):
+        self.call('cart', 'GET', '/api/cart/')
+
+    def checkout(self):
+        items = [
+            {'product_id': product_id, 'quantity': self.random.randint(1, 2)}
+            for product_id in self.random.sample(self.product_ids, min(len(self.product_ids), self.random.randint(1, 5)))
+        ]
+        self.call('order-create', 'POST', '/api/orders/', {'items': items})
+
+    def signup(self):
+        # Not from the seeded generator, so repeated runs don't collide.
+        username = 'signup-%s' % uuid.uuid4().hex
+        # Sent anonymously, as a new visitor would, without logging this user out.
+        token, self.client.token = self.client.token, None
+        try:
+            self.call('register', 'POST', '/api/auth/register/', {
+                'username': username,
+                'email': '%s@example.com' % username,
+                'password': self.password,
+                'user_type': self.random.choice(('buyer', 'seller')),
+            })
+        finally:
+            self.client.token = token
+
+    def order_history(self):
+        status, payload = self.call('order-history', 'GET', '/api/orders/history/?page_size=20')
+        if status == 200 and payload.get('next') and self.random.random() < 0.3:
+            next_url = urlsplit(payload['next'])
+            self.call('order-history', 'GET', '%s?%s' % (next_url.path, next_url.query))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run(base_url, users, product_ids, duration=30, concurrency=10, mix=None, seed=0):
+    """
+    Replay a weighted mix of user journeys against a running server for
+    `duration` seconds and return per-endpoint throughput and latencies.
+    """
+    mix = mix or DEFAULT_MIX
+    scenarios = list(mix)
+    weights = [mix[scenario] for scenario in scenarios]
+    recorder = Recorder()
+    clock = {}
+
+    def start_clock():
+        clock['start'] = time.perf_counter()
+        clock['deadline'] = clock['start'] + duration
+
+    # Logins happen before the clock starts so they don't skew the mix.
+    ready = threading.Barrier(concurrency + 1, action=start_clock)
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        username, password = users[index % len(users)]
+        client = Client(base_url)
+        user = VirtualUser(client, recorder, rng, username, password, product_ids)
+        logged_in = user.login()
+        ready.wait()
+        try:
+            while logged_in and time.perf_counter() < clock['deadline']:
+                getattr(user, rng.choices(scenarios, weights)[0])()
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - clock['start']
+
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        if endpoint == 'login':
+            continue
+        latencies = sorted(latencies)
+        endpoints[endpoint] = {
+            'requests': len(latencies),
+            'errors': recorder.errors.get(endpoint, 0),
+            'throughput': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {
+        'base_url': base_url,
+        'duration': elapsed,
+        'concurrency': concurrency,
+        'requests': total,
+        'throughput': total / elapsed if elapsed else 0,
+        'endpoints': endpoints,
+    }
+
+
+def format_report(report):
+    lines = [
+        '%s  concurrency=%d  duration=%.1fs  requests=%d  throughput=%.1f req/s' % (
+            report['base_url'], report['concurrency'], report['duration'], report['requests'], report['throughput']),
+        '%-16s %9s %7s %9s %9s %9s %9s' % ('endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'),
+    ]
+    for name, endpoint in report['endpoints'].items():
+        lines.append('%-16s %9d %7d %9.1f %9.1f %9.1f %9.1f' % (
+            name, endpoint['requests'], endpoint['errors'], endpoint['throughput'],
+            endpoint['p50_ms'], endpoint['p95_ms'], endpoint['p99_ms']))
+    return '\n'.join(lines)
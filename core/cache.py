@@ -0,0 +1,262 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from ecommerce.db_router import read_from_primary
+from ecommerce.metrics import registry
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe, per-process LRU with an optional TTL per entry.
+    """
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None, valid=None):
+        """
+        The value under `key`, or `default`. An entry that `valid(value)`
+        rejects is dropped and counts as a miss.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if (expires is None or expires > time.monotonic()) and (valid is None or valid(value)):
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def is_shared(cache):
+    """
+    Whether every worker process sees the same `cache`. Process-local
+    backends can't carry invalidations from one worker to the others.
+    """
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+class CatalogCache:
+    """
+    Two-tier read-through cache for serialized catalog payloads.
+
+    Entries live in a per-process LRU in front of the shared Django cache,
+    under keys that embed version stamps kept in the shared cache, so every
+    worker stops serving an entry on its next read once its version moves:
+
+    - 'product:<id>' versions key that product's serialized rows, and are
+      bumped by any change to it;
+    - list and search pages cache only the ids on them, under the 'lists'
+      and 'search' versions, which are bumped only by changes that can move
+      products between pages or results;
+    - 'all' is part of every key and bumped by invalidate_all().
+
+    A version is the time of the change in nanoseconds, which also makes it
+    usable as a Last-Modified value. 'modified' moves with every change.
+
+    Entries are built from the primary: a replica's rows may predate the
+    invalidation that made the entry's version current.
+
+    Nothing is cached when the shared cache is process-local (LocMemCache),
+    since other workers would never see the invalidations.
+    """
+    _missing = object()
+
+    def __init__(self):
+        options = getattr(settings, 'CATALOG_CACHE', {})
+        self.alias = options.get('CACHE_ALIAS', 'default')
+        self.timeout = options.get('TIMEOUT', 300)
+        self.local = LRUCache(options.get('LOCAL_MAX_ENTRIES', 1024), options.get('LOCAL_TTL'))
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        return is_shared(self.shared)
+
+    def version_key(self, scope):
+        return 'catalog:version:%s' % scope
+
+    def get_versions(self, scopes):
+        keys = [self.version_key(scope) for scope in scopes]
+        versions = self.shared.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            # Seed from the clock, without overwriting a concurrent bump, so
+            # a flushed or evicted version never comes back with an old value.
+            for key in missing:
+                self.shared.add(key, time.time_ns(), None)
+            versions.update(self.shared.get_many(missing))
+        return {scope: versions.get(key, 0) for scope, key in zip(scopes, keys)}
+
+    def get_modified(self):
+        """
+        Time of the last catalog change, or None when nothing is cached.
+        """
+        if not self.enabled:
+            return None
+        return self.as_datetime(self.get_versions(['modified'])['modified'])
+
+    def as_datetime(self, version):
+        return datetime.fromtimestamp(version / 1e9, tz=timezone.utc)
+
+    def digest(self, *parts):
+        return hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def format_key(self, versions, scope, digest):
+        return 'catalog:%s:%s:%s:%s' % (versions['all'], scope, versions[scope], digest)
+
+    def make_key(self, scope, *parts):
+        return self.format_key(self.get_versions(['all', scope]), scope, self.digest(*parts))
+
+    def get_or_set(self, key, builder):
+        if not self.enabled:
+            return builder()
+        value = self.local.get(key, self._missing)
+        if value is not self._missing:
+            return value
+        value = self.shared.get(key, self._missing)
+        if value is not self._missing:
+            self.shared_hits += 1
+        else:
+            self.shared_misses += 1
+            with read_from_primary():
+                value = builder()
+            self.shared.set(key, value, self.timeout)
+        self.local.set(key, value)
+        return value
+
+    def get_products(self, ids, builder, *parts):
+        """
+        {id: payload} for the products `ids`, each cached under its own
+        version. builder(missing_ids) returns {id: payload} for the rest;
+        ids it leaves out (deleted products) aren't cached.
+        """
+        if not self.enabled:
+            return builder(list(ids))
+        scopes = ['product:%s' % product_id for product_id in ids]
+        versions = self.get_versions(['all'] + scopes)
+        digest = self.digest(*parts)
+        keys = {self.format_key(versions, scope, digest): product_id for scope, product_id in zip(scopes, ids)}
+
+        found = {}
+        for key in keys:
+            value = self.local.get(key, self._missing)
+            if value is not self._missing:
+                found[key] = value
+        remote = self.shared.get_many([key for key in keys if key not in found])
+        self.shared_hits += len(remote)
+        found.update(remote)
+        for key, value in remote.items():
+            self.local.set(key, value)
+
+        missing = {product_id: key for key, product_id in keys.items() if key not in found}
+        if missing:
+            self.shared_misses += len(missing)
+            with read_from_primary():
+                built = {missing[product_id]: value for product_id, value in builder(list(missing)).items()}
+            self.shared.set_many(built, self.timeout)
+            for key, value in built.items():
+                self.local.set(key, value)
+            found.update(built)
+        return {product_id: found[key] for key, product_id in keys.items() if key in found}
+
+    def bump(self, scopes):
+        keys = [self.version_key(scope) for scope in list(scopes) + ['modified']]
+        current = self.shared.get_many(keys)
+        now = time.time_ns()
+        self.shared.set_many({key: max(now, current.get(key, 0) + 1) for key in keys}, None)
+
+    def invalidate(self, product_ids=(), lists=False, search=False):
+        """
+        Drop the cached rows of `product_ids`. Pass `lists` or `search` when
+        the change can also move products between list pages (creates,
+        deletes, price changes) or search results (creates, deletes, name
+        and description changes).
+        """
+        scopes = ['product:%s' % product_id for product_id in product_ids]
+        if lists:
+            scopes.append('lists')
+        if search:
+            scopes.append('search')
+        self.bump(scopes)
+
+    def invalidate_all(self):
+        self.bump(['all'])
+        self.local.clear()
+
+    def stats(self):
+        return {
+            'local': self.local.stats(),
+            'shared': {
+                'hits': self.shared_hits,
+                'misses': self.shared_misses,
+            },
+        }
+
+
+catalog_cache = CatalogCache()
+
+
+def collect_catalog_cache_metrics():
+    stats = catalog_cache.stats()
+    yield 'catalog_cache_hits_total', {'tier': 'local'}, stats['local']['hits']
+    yield 'catalog_cache_misses_total', {'tier': 'local'}, stats['local']['misses']
+    yield 'catalog_cache_hits_total', {'tier': 'shared'}, stats['shared']['hits']
+    yield 'catalog_cache_misses_total', {'tier': 'shared'}, stats['shared']['misses']
+    yield 'catalog_cache_evictions_total', {}, stats['local']['evictions']
+    yield 'catalog_cache_entries', {}, stats['local']['entries']
+
+
+registry.describe('catalog_cache_hits_total', 'counter', 'Catalog cache hits by tier.')
+registry.describe('catalog_cache_misses_total', 'counter', 'Catalog cache misses by tier.')
+registry.describe('catalog_cache_evictions_total', 'counter', 'Entries evicted from the local catalog LRU.')
+registry.describe('catalog_cache_entries', 'gauge', 'Entries in the local catalog LRU.')
+registry.register_collector(collect_catalog_cache_metrics)
@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .db import upsert
+from .models import Cart, CartItem, Product
+
+
+class UnknownProducts(Exception):
+    def __init__(self, product_ids):
+        super().__init__('Unknown product id(s): %s.' % ', '.join(str(i) for i in sorted(product_ids)))
+        self.product_ids = product_ids
+
+
+def fold_operations(operations):
+    """
+    Reduce an ordered list of {'op', 'product_id', 'quantity'} operations to
+    the net effect per product: ('add', n), ('set', n) or ('remove', None).
+    """
+    lines = {}
+    for operation in operations:
+        product_id = operation['product_id']
+        op = operation['op']
+        current = lines.get(product_id)
+        if op == 'remove' or (op == 'set' and operation['quantity'] == 0):
+            lines[product_id] = ('remove', None)
+        elif op == 'set':
+            lines[product_id] = ('set', operation['quantity'])
+        elif current is None:
+            lines[product_id] = ('add', operation['quantity'])
+        elif current[0] == 'remove':
+            # The line is gone by now, so adding to it sets it.
+            lines[product_id] = ('set', operation['quantity'])
+        else:
+            lines[product_id] = (current[0], current[1] + operation['quantity'])
+    return lines
+
+
+def touch(cart):
+    # Cart.updated_at versions the cart for conditional GETs, and writes to
+    # its lines don't save the cart, so bump it after each of them.
+    Cart.objects.filter(id=cart.id).update(updated_at=timezone.now())
+
+
+def rows(cart, lines):
+    return [{'cart': cart.id, 'product': product_id, 'quantity': quantity} for product_id, quantity in lines]
+
+
+def apply_operations(cart, operations):
+    """
+    Apply cart operations with at most one statement per kind of change,
+    all in one transaction. Raises UnknownProducts before writing anything.
+    """
+    lines = fold_operations(operations)
+    by_op = {'add': [], 'set': [], 'remove': []}
+    for product_id, (op, quantity) in lines.items():
+        by_op[op].append((product_id, quantity))
+
+    written = {product_id for product_id, _ in by_op['add'] + by_op['set']}
+    missing = written - set(Product.objects.filter(id__in=written).values_list('id', flat=True)) if written else set()
+    if missing:
+        raise UnknownProducts(missing)
+
+    with transaction.atomic():
+        if by_op['remove']:
+            CartItem.objects.filter(cart=cart, product_id__in=[product_id for product_id, _ in by_op['remove']]).delete()
+        upsert(CartItem, rows(cart, by_op['set']), ['cart', 'product'], replace=['quantity'])
+        upsert(CartItem, rows(cart, by_op['add']), ['cart', 'product'], increment=['quantity'])
+        touch(cart)
@@ -0,0 +1,95 @@
+"""
+Validators for conditional GETs (If-None-Match / If-Modified-Since).
+
+Each validator costs at most one narrow query and never runs the view's own
+queryset or serializer. Cart and order payloads embed live product data, so
+their validators also fold in the time of the last catalog change. Without a
+shared cache that time isn't known across workers, so there are no
+validators then.
+"""
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from .cache import catalog_cache
+from .models import Cart, Order
+
+
+def per_request(func):
+    attr = '_%s' % func.__name__
+
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        if not hasattr(request, attr):
+            setattr(request, attr, func(request, *args, **kwargs))
+        return getattr(request, attr)
+    return wrapper
+
+
+def latest(*values):
+    return max(value for value in values if value is not None)
+
+
+@per_request
+def catalog_validator(request, *args, **kwargs):
+    modified = catalog_cache.get_modified()
+    if modified is None:
+        return None, None
+    return '%s-%s' % (modified.timestamp(), catalog_cache.digest(request.build_absolute_uri())), modified
+
+
+@per_request
+def product_validator(request, id, *args, **kwargs):
+    # Only this product's changes, not the whole catalog's, move its ETag.
+    if not catalog_cache.enabled:
+        return None, None
+    versions = catalog_cache.get_versions(['all', 'product:%s' % id])
+    etag = 'product-%s-%s-%s' % (versions['all'], versions['product:%s' % id], catalog_cache.digest(request.build_absolute_uri()))
+    return etag, catalog_cache.as_datetime(max(versions.values()))
+
+
+@per_request
+def cart_validator(request, *args, **kwargs):
+    modified = catalog_cache.get_modified()
+    if modified is None:
+        return None, None
+    cart = Cart.objects.filter(user=request.user).values_list('id', 'updated_at').first()
+    if cart is None:
+        return None, None
+    cart_id, updated_at = cart
+    return 'cart-%s-%s-%s' % (cart_id, updated_at.timestamp(), modified.timestamp()), latest(updated_at, modified)
+
+
+@per_request
+def order_list_validator(request, *args, **kwargs):
+    modified = catalog_cache.get_modified()
+    if modified is None:
+        return None, None
+    summary = Order.objects.filter(user=request.user).aggregate(count=Count('id'), updated_at=Max('updated_at'))
+    updated_at = summary['updated_at']
+    etag = 'orders-%s-%s-%s' % (summary['count'], updated_at.timestamp() if updated_at else 0, modified.timestamp())
+    return etag, latest(updated_at, modified)
+
+
+@per_request
+def order_validator(request, id, *args, **kwargs):
+    modified = catalog_cache.get_modified()
+    if modified is None:
+        return None, None
+    updated_at = Order.objects.filter(id=id).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None, None
+    return 'order-%s-%s-%s' % (id, updated_at.timestamp(), modified.timestamp()), latest(updated_at, modified)
+
+
+def conditional(validator):
+    """
+    Decorate an APIView method so matching validators get a 304 before the
+    method body runs.
+    """
+    return method_decorator(condition(
+        etag_func=lambda request, *args, **kwargs: validator(request, *args, **kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: validator(request, *args, **kwargs)[1],
+    ))
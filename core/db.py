@@ -0,0 +1,70 @@
+"""
+Statements the ORM in Django 3.2 can't express.
+"""
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+
+
+def upsert(model, rows, unique_fields, increment=(), replace=()):
+    """
+    Insert `rows` (dicts keyed by field name, all with the same keys) in a
+    single statement. A row that collides with an existing one on
+    `unique_fields` instead adds its `increment` fields to that row and
+    overwrites its `replace` fields; with neither, it is left as it was.
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    opts = model._meta
+    quote = connection.ops.quote_name
+    fields = [opts.get_field(name) for name in rows[0]]
+    column = {name: quote(field.column) for name, field in zip(rows[0], fields)}
+    table = quote(opts.db_table)
+
+    if connection.vendor == 'mysql':
+        # MySQL resolves the conflict against whichever unique key matched.
+        assignments = ['%s = %s + VALUES(%s)' % (column[name], column[name], column[name]) for name in increment]
+        assignments += ['%s = VALUES(%s)' % (column[name], column[name]) for name in replace]
+        # A self-assignment is MySQL's way of ignoring just the duplicate.
+        key = quote(opts.get_field(unique_fields[0]).column)
+        conflict = 'ON DUPLICATE KEY UPDATE %s' % ', '.join(assignments or ['%s = %s' % (key, key)])
+    elif connection.vendor in ('postgresql', 'sqlite'):
+        assignments = ['%s = %s.%s + EXCLUDED.%s' % (column[name], table, column[name], column[name]) for name in increment]
+        assignments += ['%s = EXCLUDED.%s' % (column[name], column[name]) for name in replace]
+        targets = ', '.join(quote(opts.get_field(name).column) for name in unique_fields)
+        if assignments:
+            conflict = 'ON CONFLICT (%s) DO UPDATE SET %s' % (targets, ', '.join(assignments))
+        else:
+            conflict = 'ON CONFLICT (%s) DO NOTHING' % targets
+    else:
+        raise NotImplementedError('upsert() is not supported on %s.' % connection.vendor)
+
+    placeholders = '(%s)' % ', '.join(['%s'] * len(fields))
+    batch_size = connection.ops.bulk_batch_size(fields, rows)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            sql = 'INSERT INTO %s (%s) VALUES %s %s' % (
+                table,
+                ', '.join(column[name] for name in rows[0]),
+                ', '.join([placeholders] * len(batch)),
+                conflict,
+            )
+            params = [field.get_db_prep_save(row[name], connection) for row in batch for name, field in zip(rows[0], fields)]
+            cursor.execute(sql, params)
+
+def first_inserted_id(model, count):
+    """
+    SQL for the first primary key generated by this connection's last INSERT,
+    a multi-row one of `count` rows into `model`. For backends whose
+    bulk_create() doesn't set primary keys.
+    """
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor == 'mysql':
+        # A multi-row INSERT reports the first id it generated.
+        return RawSQL('LAST_INSERT_ID()', [])
+    if connection.vendor == 'sqlite':
+        # SQLite reports the last one; with a single writer the statement's
+        # rowids are consecutive.
+        return RawSQL('last_insert_rowid() - %s', [count - 1])
+    raise NotImplementedError('first_inserted_id() is not supported on %s.' % connection.vendor)
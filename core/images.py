@@ -0,0 +1,71 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .cache import catalog_cache
+from .models import Product
+
+FORMATS = (
+    ('webp', 'WEBP', '.webp'),
+    ('jpeg', 'JPEG', '.jpg'),
+)
+
+
+def get_sizes():
+    return getattr(settings, 'PRODUCT_IMAGE_SIZES', (128, 512, 1024))
+
+
+def derivative_name(name, size, extension):
+    stem, _ = os.path.splitext(name)
+    return '%s_%d%s' % (stem, size, extension)
+
+
+def render(image, size, pil_format):
+    derivative = image.copy()
+    derivative.thumbnail((size, size), Image.LANCZOS)
+    if pil_format == 'JPEG' and derivative.mode != 'RGB':
+        derivative = derivative.convert('RGB')
+    buffer = BytesIO()
+    derivative.save(buffer, pil_format, quality=82, optimize=True)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, storage=default_storage):
+    """
+    Write resized WebP and JPEG copies of the image `name` next to it and
+    return the map stored in Product.image_derivatives.
+    """
+    with storage.open(name, 'rb') as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image.load()
+
+    derivatives = {'source': name}
+    for key, pil_format, extension in FORMATS:
+        derivatives[key] = {}
+        for size in get_sizes():
+            # Never upscale: a 300px original gets no 512/1024 variants.
+            if size > max(image.size) and derivatives[key]:
+                continue
+            target = derivative_name(name, size, extension)
+            if storage.exists(target):
+                storage.delete(target)
+            derivatives[key][str(size)] = storage.save(target, ContentFile(render(image, size, pil_format)))
+    return derivatives
+
+
+def process_product(product_id):
+    product = Product.objects.only('id', 'image', 'image_derivatives').filter(id=product_id).first()
+    name = product.image.name if product is not None else None
+    if not name or product.image_derivatives.get('source') == name:
+        return False
+    derivatives = generate_derivatives(name)
+    # Only store the map if the image hasn't been replaced meanwhile.
+    updated = Product.objects.filter(id=product_id, image=name).update(image_derivatives=derivatives)
+    if updated:
+        catalog_cache.invalidate([product_id])
+    return bool(updated)
+
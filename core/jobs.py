@@ -0,0 +1,135 @@
+"""
+A database-backed job queue, so request handlers only enqueue and the
+run_jobs worker does the rest without an external broker.
+
+Jobs are enqueued in the caller's transaction, so they exist exactly when
+the data they act on was committed. Delivery is at least once: a job whose
+worker died is handed out again after LEASE seconds, so tasks must be safe
+to run twice.
+"""
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .db import upsert
+from .models import Job
+
+DEFAULTS = {
+    'MAX_ATTEMPTS': 5,
+    # Retry n waits about BACKOFF_BASE * 2 ** (n - 1) seconds, at most BACKOFF_MAX.
+    'BACKOFF_BASE': 10,
+    'BACKOFF_MAX': 3600,
+    'LEASE': 600,
+    # Finished jobs, and so their idempotency keys, are kept this long.
+    'RETENTION': timedelta(days=7),
+}
+
+
+def get_option(name):
+    return getattr(settings, 'JOBS', {}).get(name, DEFAULTS[name])
+
+
+def enqueue(task, kwargs=None, key=None, delay=0, max_attempts=None):
+    """
+    Queue a call of the function at dotted path `task` with `kwargs`. If a
+    job with the same `key` already exists, nothing is queued.
+    """
+    now = timezone.now()
+    upsert(Job, [{
+        'task': task,
+        'kwargs': kwargs or {},
+        'key': key,
+        'status': 'queued',
+        'attempts': 0,
+        'max_attempts': max_attempts or get_option('MAX_ATTEMPTS'),
+        'run_at': now + timedelta(seconds=delay),
+        'last_error': '',
+        'created_at': now,
+    }], ['key'])
+
+
+def claim(worker, batch_size, now=None):
+    """
+    Mark up to `batch_size` due jobs as running for `worker` and return them.
+    """
+    now = now or timezone.now()
+    due = Job.objects.filter(status='queued', run_at__lte=now).order_by('run_at', 'id')
+    running = dict(status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1)
+    with transaction.atomic():
+        # Concurrent workers each take different jobs instead of queueing up
+        # behind one another's locks, where the backend can skip them.
+        # MariaDB and older MySQL reject a LIMIT inside the UPDATE's IN
+        # subquery, hence the two statements.
+        skip_locked = connection.features.has_select_for_update_skip_locked
+        ids = list(due.select_for_update(skip_locked=skip_locked).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        # Still queued: without row locks (SQLite) another worker may have
+        # read the same ids first.
+        Job.objects.filter(id__in=ids, status='queued').update(**running)
+    return list(Job.objects.filter(locked_by=worker, locked_at=now).order_by('run_at', 'id'))
+
+
+def backoff(attempts):
+    delay = min(get_option('BACKOFF_BASE') * 2 ** (attempts - 1), get_option('BACKOFF_MAX'))
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def run_job(job):
+    """
+    Run a claimed job and record the outcome: done, queued again after a
+    backoff, or failed once it is out of attempts. Returns True on success.
+    """
+    try:
+        import_string(job.task)(**job.kwargs)
+    except Exception:
+        now = timezone.now()
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            changes = {'status': 'queued', 'run_at': now + backoff(job.attempts)}
+        else:
+            changes = {'status': 'failed', 'finished_at': now}
+        succeeded = False
+    else:
+        changes = {'status': 'done', 'finished_at': timezone.now()}
+        error = ''
+        succeeded = True
+    # Only if it's still ours, i.e. the lease didn't run out meanwhile.
+    Job.objects.filter(id=job.id, status='running', locked_at=job.locked_at).update(
+        locked_by=None, locked_at=None, last_error=error, **changes,
+    )
+    return succeeded
+
+
+def requeue_stale(now=None):
+    """
+    Hand jobs whose worker stopped reporting within LEASE to another worker,
+    or fail them if they are out of attempts. Returns how many were found.
+    """
+    now = now or timezone.now()
+    stale = Job.objects.filter(status='running', locked_at__lt=now - timedelta(seconds=get_option('LEASE')))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', finished_at=now, locked_by=None, locked_at=None, last_error='Worker lease expired.',
+    )
+    return failed + stale.update(status='queued', run_at=now, locked_by=None, locked_at=None)
+
+
+def purge_finished(now=None, batch_size=1000):
+    """
+    Delete jobs that finished more than RETENTION ago, a batch at a time.
+    """
+    cutoff = (now or timezone.now()) - get_option('RETENTION')
+    deleted = 0
+    for status in ('done', 'failed'):
+        while True:
+            ids = list(Job.objects.filter(status=status, finished_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += Job.objects.filter(id__in=ids).delete()[0]
+    return deleted
@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import CommandError
+
+from core.benchmark.driver import READ_MIX, format_report, run
+from core.management.commands.bench_run import Command as BenchRunCommand
+
+
+class Command(BenchRunCommand):
+    help = (
+        'Run the same read-heavy mix against several servers, e.g. gunicorn (WSGI) and uvicorn (ASGI), '
+        'and print the reports side by side.'
+    )
+    default_mix = READ_MIX
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.set_defaults(concurrency=200)
+        parser.add_argument('--target', action='append', dest='targets', default=[], metavar='NAME=URL',
+                            help='Server to benchmark; repeat for each one, e.g. --target wsgi=http://127.0.0.1:8000')
+
+    def parse_targets(self, values):
+        targets = []
+        for value in values:
+            name, _, url = value.partition('=')
+            if not name or not url:
+                raise CommandError(f'Invalid target {value!r}; expected NAME=URL.')
+            targets.append((name, url))
+        if not targets:
+            raise CommandError('Give at least one --target NAME=URL.')
+        return targets
+
+    def handle(self, *args, **options):
+        targets = self.parse_targets(options['targets'])
+        users, product_ids = self.load_users_and_products(options)
+        mix = self.parse_mix(options['mix'])
+        reports = {}
+        for name, url in targets:
+            reports[name] = run(
+                url,
+                users,
+                product_ids,
+                duration=options['duration'],
+                concurrency=options['concurrency'],
+                mix=mix,
+                seed=options['seed'],
+            )
+            self.stdout.write('[%s]\n%s\n' % (name, format_report(reports[name])))
+
+        # Percentiles are the slowest endpoint's, so a regression on one route isn't averaged away.
+        self.stdout.write('%-12s %9s %9s %9s %9s %7s' % ('target', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+        for name, report in reports.items():
+            endpoints = list(report['endpoints'].values())
+            self.stdout.write('%-12s %9.1f %9.1f %9.1f %9.1f %7d' % (
+                name,
+                report['throughput'],
+                max((endpoint['p50_ms'] for endpoint in endpoints), default=0),
+                max((endpoint['p95_ms'] for endpoint in endpoints), default=0),
+                max((endpoint['p99_ms'] for endpoint in endpoints), default=0),
+                sum(endpoint['errors'] for endpoint in endpoints),
+            ))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(reports, f, indent=2)
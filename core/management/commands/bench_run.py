@@ -0,0 +1,58 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark.datagen import PASSWORD
+from core.benchmark.driver import DEFAULT_MIX, SCENARIOS, format_report, run
+from core.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Replay a browse/cart/checkout/history mix against a running server and report latencies.'
+    default_mix = DEFAULT_MIX
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--duration', type=float, default=30)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=100, help='Number of seeded buyers to log in as.')
+        parser.add_argument('--products', type=int, default=10000, help='Number of product ids to sample from.')
+        parser.add_argument('--mix', default=None,
+                            help='Scenario weights, e.g. browse=60,add_to_cart=20,checkout=5,order_history=15')
+        parser.add_argument('--json', dest='json_path', default=None, help='Also write the report to this file.')
+
+    def parse_mix(self, value):
+        if not value:
+            return self.default_mix
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            if name not in SCENARIOS:
+                raise CommandError(f'Unknown scenario {name!r}; choose from {", ".join(SCENARIOS)}.')
+            mix[name] = int(weight)
+        return mix
+
+    def load_users_and_products(self, options):
+        usernames = list(User.objects.filter(username__startswith='buyer').order_by('id').values_list('username', flat=True)[:options['users']])
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:options['products']])
+        if not usernames or not product_ids:
+            raise CommandError('No benchmark data found; run bench_seed first.')
+        return [(username, PASSWORD) for username in usernames], product_ids
+
+    def handle(self, *args, **options):
+        users, product_ids = self.load_users_and_products(options)
+        report = run(
+            options['base_url'],
+            users,
+            product_ids,
+            duration=options['duration'],
+            concurrency=options['concurrency'],
+            mix=self.parse_mix(options['mix']),
+            seed=options['seed'],
+        )
+        self.stdout.write(format_report(report))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark.datagen import DataGenerator, PASSWORD
+
+
+class Command(BaseCommand):
+    help = 'Bulk-load a seeded synthetic dataset for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--sellers', type=int, default=100)
+        parser.add_argument('--buyers', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--carts', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--index', action='store_true', help='Also build the search index for the new products.')
+
+    def handle(self, *args, **options):
+        if options['carts'] > options['buyers']:
+            raise CommandError('Every cart belongs to a distinct buyer; --carts cannot exceed --buyers.')
+        if options['sellers'] < 1 or options['buyers'] < 1 or options['products'] < 1:
+            raise CommandError('At least one seller, buyer and product is required.')
+        generator = DataGenerator(seed=options['seed'], batch_size=options['batch_size'], log=self.stdout.write)
+        generator.generate(
+            sellers=options['sellers'],
+            buyers=options['buyers'],
+            products=options['products'],
+            carts=options['carts'],
+            orders=options['orders'],
+            index=options['index'],
+        )
+        self.stdout.write(f"Buyers log in as buyer<id> with password '{PASSWORD}'.")
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.tokens import compact_blacklist
+
+
+class Command(BaseCommand):
+    help = 'Delete expired outstanding and blacklisted refresh tokens, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches to leave room for other writers.')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep compacting every INTERVAL seconds instead of running once.')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = compact_blacklist(batch_size=options['batch_size'], pause=options['pause'])
+            self.stdout.write(f'Deleted {deleted} expired token(s).')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.images import process_product
+from core.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails and WebP copies for product images that lack them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that already exist.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if options['force']:
+            products.update(image_derivatives={})
+        generated = failed = 0
+        for product_id in products.order_by('id').values_list('id', flat=True).iterator():
+            try:
+                if process_product(product_id):
+                    generated += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'Product {product_id}: {e}')
+        self.stdout.write(f'Generated derivatives for {generated} product(s), {failed} failed.')
@@ -0,0 +1,39 @@
+import json
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.product_io import CHUNK_SIZE, FORMATS, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create or update a seller's products from a CSV or JSONL file, keyed on SKU."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input.')
+        parser.add_argument('--seller', required=True, help='Username of the seller who owns the products.')
+        parser.add_argument('--file-format', choices=FORMATS, default=None,
+                            help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            seller = User.objects.get(username=options['seller'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['seller']!r}.")
+        path = options['path']
+        file_format = options['file_format'] or path.rpartition('.')[2]
+        if file_format not in FORMATS:
+            raise CommandError('Pass --file-format; it cannot be inferred from the path.')
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            report = import_products(seller, read_rows(stream, file_format), chunk_size=options['chunk_size'])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in report.errors:
+            self.stderr.write('row %d: %s' % (error['row'], json.dumps(error['errors'])))
+        self.stdout.write(f'{report.rows} row(s): {report.created} created, {report.updated} updated, {report.error_count} rejected.')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-day product and seller sales rollups from completed orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        orders = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(f'Rolled up {orders} completed order(s).')
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Return the stock of expired reservations, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep sweeping every INTERVAL seconds instead of running once.')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired(batch_size=options['batch_size'])
+            self.stdout.write(f'Released {released} expired reservation(s).')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
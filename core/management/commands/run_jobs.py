@@ -0,0 +1,84 @@
+import logging
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.jobs import claim, purge_finished, requeue_stale, run_job
+
+logger = logging.getLogger(__name__)
+
+
+def _run(job):
+    # Worker threads aren't covered by Django's per-request connection cleanup.
+    close_old_connections()
+    try:
+        return run_job(job)
+    finally:
+        close_old_connections()
+
+
+def _result(future):
+    # run_job records task errors itself; anything else (say, the database
+    # going away while it saves the outcome) leaves the job running until
+    # requeue_stale() hands it on, and mustn't stop the worker.
+    try:
+        return future.result()
+    except Exception:
+        logger.exception('Job raised outside its task')
+        return False
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs on a thread pool. Start several for more throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Jobs run at the same time.')
+        parser.add_argument('--batch-size', type=int, default=20, help='Most jobs claimed per query.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before looking again when the queue is empty.')
+        parser.add_argument('--maintenance-interval', type=float, default=60,
+                            help='Seconds between requeueing stale jobs and purging old finished ones.')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of polling.')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        worker_id = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        results = []
+        in_flight = set()
+        next_maintenance = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jobs') as executor:
+            while not self.stopping:
+                if time.monotonic() >= next_maintenance:
+                    requeue_stale()
+                    purge_finished()
+                    next_maintenance = time.monotonic() + options['maintenance_interval']
+
+                # Only claim what can start now, so other workers get the rest.
+                free = workers - len(in_flight)
+                jobs = claim(worker_id, min(free, options['batch_size'])) if free else []
+                in_flight.update(executor.submit(_run, job) for job in jobs)
+
+                if not in_flight:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, in_flight = wait(in_flight, timeout=0 if jobs else options['poll_interval'], return_when=FIRST_COMPLETED)
+                results.extend(_result(future) for future in done)
+            results.extend(_result(future) for future in in_flight)
+        close_old_connections()
+        succeeded = results.count(True)
+        self.stdout.write(f'Ran {len(results)} job(s): {succeeded} succeeded, {len(results) - succeeded} failed.')
+
+    def stop(self, signum, frame):
+        # Finish the jobs in flight, but claim no more.
+        self.stopping = True
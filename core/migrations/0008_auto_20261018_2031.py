@@ -0,0 +1,84 @@
+# Generated by Django 3.2.9 on 2026-10-18 20:31
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_cart_items(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Cart = apps.get_model('core', 'Cart')
+    CartItem = apps.get_model('core', 'CartItem')
+    Order = apps.get_model('core', 'Order')
+    CartLinks = Cart.items.through
+    OrderLinks = Order.items.through
+
+    lines = defaultdict(list)
+    for cart_id, item_id, product_id, quantity in CartLinks.objects.using(db).order_by('cart_id', 'cartitem_id').values_list(
+            'cart_id', 'cartitem_id', 'cartitem__product_id', 'cartitem__quantity').iterator():
+        lines[cart_id, product_id].append((item_id, quantity))
+
+    # Items that also back an order line stay with the order; the cart gets
+    # its own copy.
+    ordered = set(OrderLinks.objects.using(db).filter(cartitem_id__in=CartLinks.objects.using(db).values('cartitem_id')).values_list('cartitem_id', flat=True))
+    linked = set()
+    merged = set()
+    for (cart_id, product_id), items in lines.items():
+        quantity = sum(quantity for _, quantity in items)
+        keep = next((item_id for item_id, _ in items if item_id not in ordered and item_id not in linked), None)
+        if keep is None:
+            CartItem.objects.using(db).create(cart_link_id=cart_id, product_id=product_id, quantity=quantity)
+        else:
+            CartItem.objects.using(db).filter(id=keep).update(cart_link_id=cart_id, quantity=quantity)
+            linked.add(keep)
+        merged.update(item_id for item_id, _ in items if item_id not in ordered)
+    CartItem.objects.using(db).filter(id__in=merged - linked).delete()
+
+
+def unlink_cart_items(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Cart = apps.get_model('core', 'Cart')
+    CartItem = apps.get_model('core', 'CartItem')
+    CartLinks = Cart.items.through
+    links = (
+        CartLinks(cart_id=cart_id, cartitem_id=item_id)
+        for item_id, cart_id in CartItem.objects.using(db).filter(cart_link__isnull=False).values_list('id', 'cart_link_id').iterator()
+    )
+    CartLinks.objects.using(db).bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_auto_20261018_2016'),
+    ]
+
+    operations = [
+        # Cart.items (the M2M) owns the names the new foreign key needs, so the
+        # key is added under a temporary name and renamed once the M2M is gone.
+        migrations.AddField(
+            model_name='cartitem',
+            name='cart_link',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.cart'),
+        ),
+        migrations.RunPython(link_cart_items, unlink_cart_items),
+        migrations.RemoveField(
+            model_name='cart',
+            name='items',
+        ),
+        migrations.RenameField(
+            model_name='cartitem',
+            old_name='cart_link',
+            new_name='cart',
+        ),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='cart',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.cart'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2.9 on 2026-10-18 20:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_order_lines(apps, schema_editor):
+    db = schema_editor.connection.alias
+    # Orders placed before lines were snapshotted only know the current
+    # product; that's the best price and name available for them.
+    Order = apps.get_model('core', 'Order')
+    OrderLine = apps.get_model('core', 'OrderLine')
+    Links = Order.items.through
+    batch_size = 2000
+    last_id = 0
+    while True:
+        links = list(
+            Links.objects.using(db).filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'order_id', 'cartitem__product_id', 'cartitem__product__name',
+                         'cartitem__product__price', 'cartitem__quantity')[:batch_size]
+        )
+        if not links:
+            break
+        OrderLine.objects.using(db).bulk_create([
+            OrderLine(order_id=order_id, product_id=product_id, product_name=name, unit_price=price,
+                      quantity=quantity, line_total=price * quantity)
+            for _, order_id, product_id, name, price, quantity in links
+        ])
+        last_id = links[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_auto_20261018_2031'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_name', models.CharField(max_length=100)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField()),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at'], name='core_order_user_id_dacb5a_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='core.order'),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='core.product'),
+        ),
+        migrations.RunPython(backfill_order_lines, migrations.RunPython.noop),
+    ]
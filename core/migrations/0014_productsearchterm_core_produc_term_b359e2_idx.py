@@ -0,0 +1,17 @@
+# Generated by Django 3.2.9 on 2026-10-18 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_auto_20261018_2126'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productsearchterm',
+            index=models.Index(fields=['term', '-weight', 'product'], name='core_produc_term_b359e2_idx'),
+        ),
+    ]
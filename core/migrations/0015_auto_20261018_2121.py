@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 21:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_productsearchterm_core_produc_term_b359e2_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='orderline',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, max_digits=14),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class UserProfile(models.Model):
     USER_TYPES = (
@@ -10,6 +11,19 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     user_type = models.CharField(max_length=10, choices=USER_TYPES, default='buyer')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_user_type = instance.user_type
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._saved_user_type = self.user_type
+
+    def has_changed(self):
+        return self._state.adding or self.user_type != getattr(self, '_saved_user_type', None)
+
     def __str__(self):
         return self.user.username
 
@@ -19,19 +33,64 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField()
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     seller = models.ForeignKey(User, related_name='products', on_delete=models.CASCADE)
+    sku = models.CharField(max_length=64, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Changes to these can move a product between list pages or search
+    # results, so the catalog cache tracks them.
+    tracked_fields = ('price', 'name', 'description')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'sku'], name='unique_seller_sku'),
+        ]
+        indexes = [
+            models.Index(fields=['price', 'id']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved = {field: getattr(instance, field) for field in cls.tracked_fields if field in field_names}
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        deferred = self.get_deferred_fields()
+        self._saved = {field: getattr(self, field) for field in self.tracked_fields if field not in deferred}
+
+    def changed_fields(self):
+        """
+        Tracked fields changed since the product was loaded or saved; all of
+        them for a new product.
+        """
+        saved = {} if self._state.adding else getattr(self, '_saved', {})
+        deferred = self.get_deferred_fields()
+        return {
+            field for field in self.tracked_fields
+            if field not in deferred and (field not in saved or saved[field] != getattr(self, field))
+        }
 
     def __str__(self):
         return self.name
 
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    items = models.ManyToManyField('CartItem', blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
 class CartItem(models.Model):
+    # Order lines are CartItems too; those have no cart.
+    cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE, blank=True, null=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
 class Order(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -46,39 +105,167 @@ class Order(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     items = models.ManyToManyField(CartItem)
-    total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    total_price = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     payment_method = models.CharField(max_length=20, choices=PAYMENT_CHOICES, blank=True, null=True)
     delivery_location = models.CharField(max_length=255, blank=True, null=True)
     estimated_delivery_time = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+            models.Index(fields=['status', 'id']),
+        ]
     
     def __str__(self):
         return f'Order {self.id} by {self.user.username}'
 
     def calculate_total_price(self):
-        self.total_price = sum(item.product.price * item.quantity for item in self.items.all())
-        self.save()
+        from .orders import calculate_total
+        calculate_total(self)
+
+    def update(self, status=None, **changes):
+        """
+        Change several fields, and optionally the status, in one write.
+        See core.orders.update_order.
+        """
+        from .orders import update_order
+        return update_order(self, status, **changes)
 
     def update_status(self, new_status):
-        if new_status in dict(self.STATUS_CHOICES):
-            self.status = new_status
-            self.save()
-        else:
-            raise ValueError("Invalid status")
+        self.update(status=new_status)
 
     def set_payment_method(self, payment_method):
-        if payment_method in dict(self.PAYMENT_CHOICES):
-            self.payment_method = payment_method
-            self.save()
-        else:
-            raise ValueError("Invalid payment method")
+        self.update(payment_method=payment_method)
 
     def set_delivery_location(self, location):
-        self.delivery_location = location
-        self.save()
+        self.update(delivery_location=location)
 
     def set_estimated_delivery_time(self, delivery_time):
-        self.estimated_delivery_time = delivery_time
-        self.save()
+        self.update(estimated_delivery_time=delivery_time)
+
+
+class OrderLine(models.Model):
+    """
+    What was bought, at the name and price it had when the order was placed.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, related_name='order_lines', blank=True, null=True)
+    product_name = models.CharField(max_length=100)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+    # A unit price times a quantity can outgrow the price's ten digits.
+    line_total = models.DecimalField(max_digits=14, decimal_places=2)
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_name}'
+
+
+class StockReservation(models.Model):
+    STATUS_CHOICES = (
+        ('held', 'Held'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+        ('expired', 'Expired'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations', blank=True, null=True)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations', blank=True, null=True)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} ({self.status})'
+
+class ProductSearchTerm(models.Model):
+    # One posting of the inverted index over Product.name and description.
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'product'], name='unique_search_term_product'),
+        ]
+        indexes = [
+            models.Index(fields=['term', '-weight', 'product']),
+        ]
+
+
+class ProductSalesDaily(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_daily')
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='product_sales_daily')
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='unique_product_sales_day'),
+        ]
+        indexes = [
+            models.Index(fields=['seller', 'day']),
+        ]
+
 
+class SellerSalesDaily(models.Model):
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sales_daily')
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'day'], name='unique_seller_sales_day'),
+        ]
+
+
+class Job(models.Model):
+    """
+    Background work for the run_jobs worker: `task` is the dotted path of a
+    function called with `kwargs`. See core.jobs.
+    """
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    task = models.CharField(max_length=255)
+    kwargs = models.JSONField(default=dict)
+    # Enqueueing a key that's already queued or recently finished is a no-op.
+    key = models.CharField(max_length=255, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key'], name='unique_job_key'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+            models.Index(fields=['status', 'finished_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.task} ({self.status})'
@@ -0,0 +1,134 @@
+"""
+Order status transitions and field updates that write only what changed.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Order
+from .reservations import commit_orders, release_orders
+from .rollups import record_cancelled, record_completed
+
+# Allowed moves; moving an order to the status it already has is a no-op.
+TRANSITIONS = {
+    'pending': {'completed', 'cancelled'},
+    'completed': {'cancelled'},
+    'cancelled': set(),
+}
+EDITABLE_FIELDS = ('payment_method', 'delivery_location', 'estimated_delivery_time')
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+class OutOfStock(InvalidTransition):
+    # The order's stock hold expired before it completed and the stock it
+    # needs has been sold since.
+    pass
+
+
+def check_transition(previous, status):
+    if status not in TRANSITIONS:
+        raise ValueError('Invalid status')
+    if status != previous and status not in TRANSITIONS[previous]:
+        raise InvalidTransition('Cannot move an order from %s to %s.' % (previous, status))
+
+
+def validate_changes(changes):
+    unknown = set(changes) - set(EDITABLE_FIELDS)
+    if unknown:
+        raise ValueError('Cannot change %s.' % ', '.join(sorted(unknown)))
+    payment_method = changes.get('payment_method')
+    if payment_method is not None and payment_method not in dict(Order.PAYMENT_CHOICES):
+        raise ValueError('Invalid payment method')
+
+
+def after_transition(order_ids, previous, status):
+    """
+    Keep stock reservations and sales rollups in step with orders moving
+    from `previous` to `status`. Returns the ids of orders that can't
+    complete after all because they are out of stock; those must stay where
+    they were.
+    """
+    short = set()
+    if status == 'completed':
+        short = commit_orders(order_ids)
+        record_completed([order_id for order_id in order_ids if order_id not in short])
+    elif status == 'cancelled':
+        release_orders(order_ids)
+        if previous == 'completed':
+            record_cancelled(order_ids)
+    return short
+
+
+def _write(order, changes):
+    for field, value in changes.items():
+        setattr(order, field, value)
+    if changes:
+        order.save(update_fields=[*changes, 'updated_at'])
+    return order
+
+
+def update_order(order, status=None, **changes):
+    """
+    Apply `changes` to `order`, and move it to `status` if given, in a single
+    UPDATE of just those columns.
+    """
+    validate_changes(changes)
+    if status is None:
+        return _write(order, changes)
+    with transaction.atomic():
+        # Lock the row so concurrent transitions can't both count the sale.
+        previous = Order.objects.select_for_update().filter(id=order.id).values_list('status', flat=True).get()
+        check_transition(previous, status)
+        if status == previous:
+            order.status = status
+            return _write(order, changes)
+        if after_transition([order.id], previous, status):
+            raise OutOfStock('Order %d cannot be completed: its stock hold expired and the stock has sold out.' % order.id)
+        _write(order, dict(changes, status=status))
+    return order
+
+
+def bulk_transition(queryset, status):
+    """
+    Move every order in `queryset` that is allowed to reach `status` there,
+    with one UPDATE per source status. Orders that are out of stock stay
+    where they were. Returns the number of orders moved.
+    """
+    check_transition(status, status)
+    moved = 0
+    now = timezone.now()
+    with transaction.atomic():
+        for previous, targets in TRANSITIONS.items():
+            if status not in targets:
+                continue
+            order_ids = list(queryset.filter(status=previous).select_for_update().order_by().values_list('id', flat=True))
+            if not order_ids:
+                continue
+            short = after_transition(order_ids, previous, status)
+            order_ids = [order_id for order_id in order_ids if order_id not in short]
+            Order.objects.filter(id__in=order_ids).update(status=status, updated_at=now)
+            moved += len(order_ids)
+    return moved
+
+
+def calculate_total(order):
+    """
+    Set `order.total_price` to the sum of its lines, added up in the database.
+    """
+    order.total_price = order.lines.aggregate(total=Sum('line_total'))['total'] or 0
+    order.save(update_fields=['total_price', 'updated_at'])
+    return order.total_price
+
+
+def after_order_placed(order_id):
+    """
+    Post-checkout work, queued by checkout and run by the job worker.
+    """
+    order = Order.objects.filter(id=order_id).first()
+    if order is None or order.estimated_delivery_time is not None:
+        return
+    order.update(estimated_delivery_time=order.created_at + settings.ORDER_DELIVERY_ESTIMATE)
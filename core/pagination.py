@@ -0,0 +1,121 @@
+import base64
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination:
+    """
+    Forward-only keyset ("seek") pagination.
+
+    The cursor holds the ordering values of the last row on the page, so the
+    next page is a `WHERE (a, b) > (x, y) ORDER BY a, b LIMIT n` range scan
+    instead of an OFFSET that gets slower the deeper a client pages.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    page_size = 50
+    max_page_size = 200
+
+    # Every ordering must end with a unique column so the keyset is total.
+    orderings = {
+        'id': ('id',),
+        'price': ('price', 'id'),
+    }
+    default_ordering = 'id'
+
+    def __init__(self, orderings=None, default_ordering=None):
+        if orderings is not None:
+            self.orderings = orderings
+        if default_ordering is not None:
+            self.default_ordering = default_ordering
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: 'A positive integer is required.'})
+        if page_size <= 0:
+            raise ValidationError({self.page_size_query_param: 'A positive integer is required.'})
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        value = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        descending = value.startswith('-')
+        fields = self.orderings.get(value.lstrip('-'))
+        if fields is None:
+            raise ValidationError({self.ordering_query_param: 'Must be one of: %s.' % ', '.join(sorted(self.orderings))})
+        return value, fields, descending
+
+    def get_ordering_fields(self, request):
+        return self.get_ordering(request)[1]
+
+    def decode_cursor(self, request, model, fields):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+        except Exception:
+            raise NotFound('Invalid cursor')
+
+    def encode_cursor(self, row, fields):
+        values = [getattr(row, field) for field in fields]
+        values = [value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def keyset_filter(self, fields, values, descending):
+        lookup = 'lt' if descending else 'gt'
+        condition = Q()
+        for index, field in enumerate(fields):
+            step = Q(**{'%s__%s' % (field, lookup): values[index]})
+            for previous, value in zip(fields[:index], values[:index]):
+                step &= Q(**{previous: value})
+            condition |= step
+        return condition
+
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        self.ordering, fields, descending = self.get_ordering(request)
+        self.fields = fields
+        page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request, queryset.model, fields)
+        if cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(fields, cursor, descending))
+        queryset = queryset.order_by(*[('-' if descending else '') + field for field in fields])
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_next_cursor(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1], self.fields)
+
+    def get_next_link(self):
+        cursor = self.get_next_cursor()
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
@@ -0,0 +1,10 @@
+from rest_framework.permissions import BasePermission
+
+
+class IsSeller(BasePermission):
+    message = 'Only sellers can do this.'
+
+    def has_permission(self, request, view):
+        profile = getattr(request.user, 'userprofile', None)
+        return bool(request.user and request.user.is_authenticated and profile is not None
+                    and profile.user_type in ('seller', 'hybrid'))
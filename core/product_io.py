@@ -0,0 +1,153 @@
+"""
+Streaming CSV/JSONL import and export of a seller's products, keyed on SKU.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import catalog_cache
+from .db import upsert
+from .models import Product
+from .search import index_products
+from .serializers import ProductImportSerializer
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ProductImportSerializer.Meta.fields
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+def read_rows(lines, format):
+    """
+    Yield (row number, dict) from an iterable of text lines, without
+    reading ahead more than one line.
+    """
+    if format == 'csv':
+        for number, row in enumerate(csv.DictReader(lines), 1):
+            yield number, row
+    elif format == 'jsonl':
+        number = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else {'__invalid__': line}
+    else:
+        raise ValueError('Unknown format %r; use one of %s.' % (format, ', '.join(FORMATS)))
+
+
+def decode_lines(byte_lines, encoding='utf-8'):
+    for line in byte_lines:
+        yield line.decode(encoding) if isinstance(line, bytes) else line
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, number, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def _import_chunk(seller, chunk, report):
+    valid = {}
+    for number, row in chunk:
+        if '__invalid__' in row:
+            report.add_error(number, {'non_field_errors': ['Not a JSON object.']})
+            continue
+        serializer = ProductImportSerializer(data=row)
+        if serializer.is_valid():
+            # A SKU repeated within the input: the last row wins.
+            valid[serializer.validated_data['sku']] = serializer.validated_data
+        else:
+            report.add_error(number, serializer.errors)
+    if not valid:
+        return
+
+    now = timezone.now()
+    with transaction.atomic():
+        existing = set(Product.objects.filter(seller=seller, sku__in=valid).values_list('sku', flat=True))
+        upsert(Product, [
+            dict(data, seller=seller.id, image_derivatives={}, updated_at=now) for data in valid.values()
+        ], ['seller', 'sku'], replace=['name', 'description', 'price', 'stock', 'updated_at'])
+        # Bulk writes skip the post_save receivers, so index here.
+        index_products(Product.objects.filter(seller=seller, sku__in=valid).only('id', 'name', 'description'))
+    report.created += len(valid) - len(existing)
+    report.updated += len(existing)
+
+
+def import_products(seller, rows, chunk_size=CHUNK_SIZE):
+    """
+    Create or update `seller`'s products from (row number, dict) pairs, one
+    transaction per chunk. Invalid rows are reported and skipped.
+    """
+    report = ImportReport()
+    rows = iter(rows)
+    try:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            report.rows += len(chunk)
+            _import_chunk(seller, chunk, report)
+    finally:
+        if report.created or report.updated:
+            catalog_cache.invalidate_all()
+    return report
+
+
+def export_products(seller, format, chunk_size=CHUNK_SIZE):
+    """
+    Yield `seller`'s products as CSV or JSONL text, reading them in
+    primary-key order one chunk at a time.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown format %r; use one of %s.' % (format, ', '.join(FORMATS)))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def csv_line(values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    if format == 'csv':
+        yield csv_line(FIELDS)
+    last_id = 0
+    while True:
+        rows = list(Product.objects.filter(seller=seller, id__gt=last_id).order_by('id').values_list('id', *FIELDS)[:chunk_size])
+        if not rows:
+            return
+        for row in rows:
+            values = row[1:]
+            if format == 'csv':
+                yield csv_line(values)
+            else:
+                product = dict(zip(FIELDS, values))
+                product['price'] = str(product['price'])
+                yield json.dumps(product) + '\n'
+        last_id = rows[-1][0]
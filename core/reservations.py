@@ -0,0 +1,143 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, When, Value
+from django.utils import timezone
+
+from .cache import catalog_cache
+from .models import Product, StockReservation
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(f'Insufficient stock for product {product_id}')
+        self.product_id = product_id
+
+
+class _BatchRaced(Exception):
+    pass
+
+
+def get_ttl():
+    return getattr(settings, 'STOCK_RESERVATION_TTL', timedelta(minutes=15))
+
+
+def _per_product(quantities):
+    return Case(*[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()])
+
+
+def take_stock(quantities):
+    """
+    Decrement stock for {product_id: quantity} with one conditional UPDATE,
+    or raise InsufficientStock and change nothing.
+    """
+    if not quantities:
+        return
+    condition = Q()
+    for product_id, quantity in quantities.items():
+        condition |= Q(id=product_id, stock__gte=quantity)
+    try:
+        with transaction.atomic():
+            # No SELECT first: concurrent checkouts of one product queue on the
+            # row lock instead of racing a read-modify-write.
+            updated = Product.objects.filter(condition).update(stock=F('stock') - _per_product(quantities))
+            if updated != len(quantities):
+                raise InsufficientStock(None)
+            # Catalog rows show stock, so these products' cached rows and
+            # ETags must change; list and search pages only hold ids.
+            product_ids = list(quantities)
+            transaction.on_commit(lambda: catalog_cache.invalidate(product_ids))
+    except InsufficientStock:
+        stock = dict(Product.objects.filter(id__in=quantities).values_list('id', 'stock'))
+        short = [product_id for product_id in sorted(quantities) if stock.get(product_id, 0) < quantities[product_id]]
+        raise InsufficientStock(short[0] if short else None)
+
+
+def return_stock(quantities):
+    """
+    Add `quantities` ({product_id: quantity}) back to stock in one UPDATE.
+    """
+    if not quantities:
+        return
+    Product.objects.filter(id__in=quantities).update(stock=F('stock') + _per_product(quantities))
+    product_ids = list(quantities)
+    transaction.on_commit(lambda: catalog_cache.invalidate(product_ids))
+
+
+def reserve(quantities, user=None, order=None, ttl=None):
+    """
+    Hold stock for {product_id: quantity}. Either every line is held or,
+    with InsufficientStock, none is.
+    """
+    if not quantities:
+        return []
+    expires_at = timezone.now() + (ttl or get_ttl())
+    with transaction.atomic(savepoint=False):
+        take_stock(quantities)
+        return StockReservation.objects.bulk_create([
+            StockReservation(product_id=product_id, quantity=quantity, user=user, order=order, expires_at=expires_at)
+            for product_id, quantity in sorted(quantities.items())
+        ])
+
+
+def commit_orders(order_ids):
+    """
+    Turn the holds of orders that completed into permanent stock decrements.
+    Holds that expired in the meantime take their stock again. Returns the
+    ids of orders that can't get it back; their holds are left as they were.
+    """
+    with transaction.atomic():
+        expired = {}
+        for order_id, product_id, quantity in StockReservation.objects.filter(
+            order_id__in=order_ids, status='expired'
+        ).values_list('order_id', 'product_id', 'quantity'):
+            expired.setdefault(order_id, Counter())[product_id] += quantity
+        short = set()
+        if expired:
+            try:
+                take_stock(sum(expired.values(), Counter()))
+            except InsufficientStock:
+                # Find out which orders can't be filled, one at a time.
+                for order_id, quantities in expired.items():
+                    try:
+                        take_stock(quantities)
+                    except InsufficientStock:
+                        short.add(order_id)
+        committed = [order_id for order_id in order_ids if order_id not in short]
+        StockReservation.objects.filter(order_id__in=committed, status__in=['held', 'expired']).update(status='committed')
+    return short
+
+
+def release_orders(order_ids, batch_size=500):
+    return _release(StockReservation.objects.filter(order_id__in=order_ids, status='held'), 'released', batch_size)
+
+
+def release_expired(batch_size=500, now=None):
+    queryset = StockReservation.objects.filter(status='held', expires_at__lte=now or timezone.now())
+    return _release(queryset, 'expired', batch_size)
+
+
+def _release(queryset, status, batch_size):
+    released = 0
+    while True:
+        try:
+            with transaction.atomic():
+                batch = queryset.order_by('id')
+                if connection.features.has_select_for_update_skip_locked:
+                    batch = batch.select_for_update(skip_locked=True)
+                batch = list(batch.values_list('id', 'product_id', 'quantity')[:batch_size])
+                if not batch:
+                    return released
+                ids = [reservation_id for reservation_id, product_id, quantity in batch]
+                if StockReservation.objects.filter(id__in=ids, status='held').update(status=status) != len(batch):
+                    # Another sweeper got to part of this batch first.
+                    raise _BatchRaced
+                quantities = Counter()
+                for reservation_id, product_id, quantity in batch:
+                    quantities[product_id] += quantity
+                return_stock(quantities)
+                released += len(batch)
+        except _BatchRaced:
+            continue
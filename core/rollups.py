@@ -0,0 +1,82 @@
+"""
+Per-day sales rollups by product and by seller.
+
+Completed orders count on the day they were placed. Completing an order
+adds its lines and cancelling a completed one subtracts them, so the
+rollups always equal a fresh aggregate over completed orders, which is
+exactly what rebuild() recomputes.
+"""
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+from .db import upsert
+from .models import Order, OrderLine, ProductSalesDaily, SellerSalesDaily
+
+BATCH_SIZE = 1000
+COUNTERS = ['units', 'revenue', 'orders']
+
+
+def _lines(order_ids):
+    # Lines of since-deleted products have no seller left to credit.
+    return OrderLine.objects.filter(order_id__in=order_ids, product__isnull=False).order_by()
+
+
+def _apply(order_ids, sign):
+    day = TruncDate('order__created_at')
+    totals = dict(units=Sum('quantity'), revenue=Sum('line_total'), orders=Count('order_id', distinct=True))
+    products = _lines(order_ids).values('product_id', 'product__seller_id', day=day).annotate(**totals)
+    sellers = _lines(order_ids).values('product__seller_id', day=day).annotate(**totals)
+    upsert(ProductSalesDaily, [
+        {'product': row['product_id'], 'seller': row['product__seller_id'], 'day': row['day'],
+         'units': sign * row['units'], 'revenue': sign * row['revenue'], 'orders': sign * row['orders']}
+        for row in products
+    ], ['product', 'day'], increment=COUNTERS)
+    upsert(SellerSalesDaily, [
+        {'seller': row['product__seller_id'], 'day': row['day'],
+         'units': sign * row['units'], 'revenue': sign * row['revenue'], 'orders': sign * row['orders']}
+        for row in sellers
+    ], ['seller', 'day'], increment=COUNTERS)
+
+
+def _apply_in_batches(order_ids, sign):
+    order_ids = sorted(set(order_ids))
+    with transaction.atomic(savepoint=False):
+        for start in range(0, len(order_ids), BATCH_SIZE):
+            _apply(order_ids[start:start + BATCH_SIZE], sign)
+
+
+def record_completed(order_ids):
+    """
+    Add orders that just became 'completed' to the rollups. Callers must
+    make sure each order is counted once, i.e. only on the transition.
+    """
+    _apply_in_batches(order_ids, 1)
+
+
+def record_cancelled(order_ids):
+    """
+    Take orders that were 'completed' and are now 'cancelled' back out.
+    """
+    _apply_in_batches(order_ids, -1)
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    """
+    Recompute both rollups from every completed order in one transaction,
+    so readers keep the old figures until the new ones are complete.
+    """
+    with transaction.atomic():
+        ProductSalesDaily.objects.all().delete()
+        SellerSalesDaily.objects.all().delete()
+        last_id = 0
+        count = 0
+        while True:
+            order_ids = list(
+                Order.objects.filter(status='completed', id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                return count
+            _apply(order_ids, 1)
+            count += len(order_ids)
+            last_id = order_ids[-1]
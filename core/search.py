@@ -0,0 +1,105 @@
+import re
+from collections import Counter
+
+from django.db import transaction
+
+from .models import Product, ProductSearchTerm
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = ProductSearchTerm._meta.get_field('term').max_length
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+# How deep search() reads into one term's postings.
+MAX_CANDIDATES = 1000
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is',
+    'it', 'of', 'on', 'or', 'the', 'to', 'with',
+))
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall((text or '').lower())
+        if token not in STOP_WORDS
+    ]
+
+
+def build_postings(product):
+    weights = Counter()
+    for term in tokenize(product.name):
+        weights[term] += NAME_WEIGHT
+    for term in tokenize(product.description):
+        weights[term] += DESCRIPTION_WEIGHT
+    return [ProductSearchTerm(term=term, product_id=product.id, weight=weight) for term, weight in weights.items()]
+
+
+def index_products(products):
+    products = list(products)
+    with transaction.atomic():
+        ProductSearchTerm.objects.filter(product_id__in=[product.id for product in products]).delete()
+        ProductSearchTerm.objects.bulk_create(
+            [posting for product in products for posting in build_postings(product)],
+            batch_size=1000,
+        )
+
+
+def rebuild_index(batch_size=1000):
+    ProductSearchTerm.objects.all().delete()
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = list(Product.objects.filter(id__gt=last_id).order_by('id').only('id', 'name', 'description')[:batch_size])
+        if not batch:
+            return indexed
+        with transaction.atomic():
+            ProductSearchTerm.objects.bulk_create(
+                [posting for product in batch for posting in build_postings(product)],
+                batch_size=1000,
+            )
+        indexed += len(batch)
+        last_id = batch[-1].id
+
+
+def search(query, offset=0, limit=20):
+    """
+    Return [(product_id, score)] for products containing every term of
+    `query`, best match first. Only the index is read; callers load the
+    products for the page themselves.
+
+    Each term is read in weight order and at most MAX_CANDIDATES postings
+    deep, so a common term costs an index range scan of fixed size rather
+    than an aggregate over every product it appears in. A term with fewer
+    postings than that narrows the others down to its products, which
+    keeps the results exact; only when every term is common are matches
+    beyond the first MAX_CANDIDATES of each term left out.
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return []
+    postings = {}
+    for term in terms:
+        rows = ProductSearchTerm.objects.filter(term=term).order_by('-weight', 'product_id')
+        postings[term] = dict(rows.values_list('product_id', 'weight')[:MAX_CANDIDATES + 1])
+
+    complete = [term for term in terms if len(postings[term]) <= MAX_CANDIDATES]
+    if complete:
+        candidates = set.intersection(*(set(postings[term]) for term in complete))
+        partial = [term for term in terms if term not in complete]
+        if candidates and partial:
+            # Look up the common terms' weights for just these products.
+            rows = ProductSearchTerm.objects.filter(term__in=partial, product_id__in=candidates)
+            for term in partial:
+                postings[term] = {}
+            for term, product_id, weight in rows.values_list('term', 'product_id', 'weight'):
+                postings[term][product_id] = weight
+    else:
+        candidates = set.intersection(*(set(weights) for weights in postings.values()))
+
+    scores = {}
+    for product_id in candidates:
+        weights = [postings[term].get(product_id) for term in terms]
+        if None not in weights:
+            scores[product_id] = sum(weights)
+    ranked = sorted(scores.items(), key=lambda match: (-match[1], match[0]))
+    return ranked[offset:offset + limit]
@@ -1,6 +1,15 @@
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
 from rest_framework import serializers
+from rest_framework_simplejwt.settings import api_settings
 from django.contrib.auth.models import User
-from .models import Product, Cart, CartItem, Order, UserProfile
+from .db import first_inserted_id
+from .jobs import enqueue
+from .models import Product, Cart, CartItem, Order, OrderLine, UserProfile
+from .reservations import reserve, InsufficientStock
+from .tokens import RefreshToken
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,18 +21,58 @@ class UserProfileSerializer(serializers.ModelSerializer):
         model = UserProfile
         fields = ['user', 'user_type']
 
-class ProductSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    """
+    Accepts an optional `fields` argument that limits the serialized output
+    to the named fields, so list clients can skip expensive ones.
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+class ImageDerivativesField(serializers.Field):
+    """
+    Renders Product.image_derivatives as {format: {width: url}}, ready to be
+    joined into a srcset.
+    """
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        images = {}
+        for image_format, names in value.items():
+            if image_format == 'source':
+                continue
+            images[image_format] = {}
+            for width, name in names.items():
+                url = default_storage.url(name)
+                images[image_format][width] = request.build_absolute_uri(url) if request is not None else url
+        return images
+
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     image = serializers.ImageField(required=False)
+    images = ImageDerivativesField(source='image_derivatives')
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'stock', 'image', 'seller']
+        fields = ['id', 'name', 'description', 'price', 'stock', 'image', 'images', 'seller']
         read_only_fields = ['seller']
 
     def create(self, validated_data):
         validated_data['seller'] = self.context['request'].user
         return super().create(validated_data)
 
+class ProductImportSerializer(ProductSerializer):
+    sku = serializers.CharField(max_length=64)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ['sku', 'name', 'description', 'price', 'stock']
+
 class CartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField(write_only=True)
     product = ProductSerializer(read_only=True)
@@ -70,8 +119,33 @@ class CartSerializer(serializers.ModelSerializer):
             item['product']['image'] = request.build_absolute_uri(item['product']['image'])
         return response
 
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        if data['op'] == 'add' and not data.get('quantity'):
+            raise serializers.ValidationError({'quantity': 'Adding needs a quantity of at least 1.'})
+        if data['op'] == 'set' and 'quantity' not in data:
+            raise serializers.ValidationError({'quantity': 'This field is required.'})
+        return data
+
+class CartItemQuantitySerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+class CartBatchSerializer(serializers.Serializer):
+    max_operations = 500
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, value):
+        if len(value) > self.max_operations:
+            raise serializers.ValidationError('At most %d operations per batch.' % self.max_operations)
+        return value
+
 class OrderSerializer(serializers.ModelSerializer):
-    items = CartItemSerializer(many=True)
+    items = CartItemSerializer(many=True, allow_empty=False)
 
     class Meta:
         model = Order
@@ -80,19 +154,87 @@ class OrderSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
-        order = Order.objects.create(user=self.context['request'].user, total_price=0, **validated_data)
+        product_ids = {item_data['product_id'] for item_data in items_data}
+
+        with transaction.atomic():
+            products = Product.objects.in_bulk(product_ids)
+            missing = product_ids - set(products)
+            if missing:
+                raise serializers.ValidationError({'items': 'Unknown product id(s): %s.' % ', '.join(str(i) for i in sorted(missing))})
+
+            total_price = sum(products[item_data['product_id']].price * item_data['quantity'] for item_data in items_data)
+            order = Order.objects.create(user=self.context['request'].user, total_price=total_price, **validated_data)
+
+            quantities = Counter()
+            for item_data in items_data:
+                quantities[item_data['product_id']] += item_data['quantity']
+            try:
+                reserve(quantities, user=order.user, order=order)
+            except InsufficientStock as e:
+                raise serializers.ValidationError({'items': str(e)})
+
+            cart_items = [
+                CartItem(product=products[item_data['product_id']], quantity=item_data['quantity'])
+                for item_data in items_data
+            ]
+            CartItem.objects.bulk_create(cart_items)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # MySQL and SQLite don't hand back ids from a multi-row INSERT,
+                # and the M2M rows below need them. From the first id it
+                # generated on, the only rows in neither a cart nor an order
+                # that this transaction can see are the ones it just inserted.
+                ids = (
+                    CartItem.objects.filter(cart=None, order=None, id__gte=first_inserted_id(CartItem, len(cart_items)))
+                    .order_by('id').values_list('id', flat=True)
+                )
+                for cart_item, cart_item_id in zip(cart_items, ids):
+                    cart_item.id = cart_item_id
+
+            Through = Order.items.through
+            Through.objects.bulk_create([Through(order=order, cartitem=cart_item) for cart_item in cart_items])
+
+            OrderLine.objects.bulk_create([
+                OrderLine(
+                    order=order,
+                    product=products[item_data['product_id']],
+                    product_name=products[item_data['product_id']].name,
+                    unit_price=products[item_data['product_id']].price,
+                    quantity=item_data['quantity'],
+                    line_total=products[item_data['product_id']].price * item_data['quantity'],
+                )
+                for item_data in items_data
+            ])
+            # Everything that can wait runs in the job worker, off checkout.
+            enqueue('core.orders.after_order_placed', {'order_id': order.id}, key='order-placed:%d' % order.id)
 
-        total_price = 0
-        for item_data in items_data:
-            product_id = item_data.pop('product_id')
-            product = Product.objects.get(id=product_id)
-            cart_item = CartItem.objects.create(product=product, **item_data)
-            order.items.add(cart_item)
-            total_price += product.price * item_data['quantity']
-        
-        order.total_price = total_price
-        order.save()
-        
         return order
 
+class OrderLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderLine
+        fields = ['product_id', 'product_name', 'unit_price', 'quantity', 'line_total']
+
+class OrderHistorySerializer(serializers.ModelSerializer):
+    lines = OrderLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'total_price', 'created_at', 'lines']
+
+class TokenRefreshSerializer(serializers.Serializer):
+    # simplejwt's serializer hardcodes its own RefreshToken class.
+    refresh = serializers.CharField()
+    access = serializers.ReadOnlyField()
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            data['refresh'] = str(refresh)
 
+        return data
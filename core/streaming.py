@@ -0,0 +1,53 @@
+"""
+Stream large list responses as one JSON array, a chunk of rows at a time.
+"""
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+CHUNK_SIZE = 500
+
+
+def iterate_chunks(queryset, chunk_size=None, prefetch=()):
+    """
+    Yield lists of up to `chunk_size` rows in primary-key order.
+
+    Each chunk is its own keyset query rather than one QuerySet.iterator():
+    MySQLdb buffers a whole result set client-side, and iterator() drops
+    prefetch_related, so neither keeps memory flat here.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    last_pk = None
+    queryset = queryset.order_by('pk')
+    while True:
+        chunk = list((queryset if last_pk is None else queryset.filter(pk__gt=last_pk))[:chunk_size])
+        if not chunk:
+            return
+        if prefetch:
+            prefetch_related_objects(chunk, *prefetch)
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def render_chunks(chunks, serialize):
+    renderer = JSONRenderer()
+    yield b'['
+    first = True
+    for chunk in chunks:
+        # Render each chunk as a list and splice off its brackets so every
+        # row goes through the same encoder settings as a normal response.
+        body = renderer.render(serialize(chunk))[1:-1]
+        if body:
+            yield body if first else b',' + body
+            first = False
+    yield b']'
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    def __init__(self, chunks, serialize, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(render_chunks(chunks, serialize), **kwargs)
+
+
+def wants_stream(request):
+    return request.query_params.get('stream') == '1'
@@ -1,3 +1,1275 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.test import AsyncRequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import URLPattern, path, reverse
+from PIL import Image
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ecommerce import urls
+from ecommerce.db_backends.pool import ConnectionPool, PoolTimeout
+from ecommerce.db_router import replica_monitor, sticky_key
+from ecommerce.metrics import registry as metrics_registry
+
+from . import async_views, views
+from .authentication import UserCache, user_cache
+from .cache import catalog_cache
+from .images import generate_derivatives, process_product
+from .models import (
+    Product, Cart, CartItem, Order, OrderLine, StockReservation, ProductSalesDaily, SellerSalesDaily, UserProfile, Job,
+    ProductSearchTerm,
+)
+from .reservations import InsufficientStock, reserve, release_expired
+from .jobs import claim, enqueue, requeue_stale, run_job
+from .orders import InvalidTransition, OutOfStock, bulk_transition
+from .rollups import rebuild as rebuild_rollups
+from .search import index_products, search
+from .streaming import iterate_chunks
+from .tokens import RefreshToken, blacklist_filter, compact_blacklist
+
+
+class QueryBudgetMixin:
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        if len(context) > budget:
+            queries = '\n'.join('%d. %s' % (i, query['sql']) for i, query in enumerate(context.captured_queries, 1))
+            self.fail('%d queries executed, budget is %d:\n%s' % (len(context), budget, queries))
+
+
+class EndpointQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    # Each budget must hold no matter how many items a cart or order holds.
+    budgets = {
+        'cart': 3,
+        'add-to-cart': 5,
+        'cart-batch': 11,
+        'order-list': 3,
+        'order-history': 2,
+        'order-detail': 3,
+        'order-create': 13,
+        'register': 5,
+    }
+    sizes = (1, 10)
+
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def make_products(self, count):
+        return [
+            Product.objects.create(name='Product %d' % i, description='', price=10, stock=100, seller=self.seller)
+            for i in range(count)
+        ]
+
+    def make_items(self, count):
+        return [CartItem.objects.create(product=product, quantity=1) for product in self.make_products(count)]
+
+    def make_order(self, count):
+        order = Order.objects.create(user=self.user)
+        order.items.add(*self.make_items(count))
+        return order
+
+    def test_cart(self):
+        cart = Cart.objects.create(user=self.user)
+        for size in self.sizes:
+            cart.items.set(self.make_items(size))
+            with self.assertQueryBudget(self.budgets['cart']):
+                response = self.client.get(reverse('cart'))
+            self.assertEqual(len(response.data['items']), size)
+
+    def test_add_to_cart(self):
+        cart = Cart.objects.create(user=self.user)
+        for size in self.sizes:
+            cart.items.set(self.make_items(size))
+            product = self.make_products(1)[0]
+            with self.assertQueryBudget(self.budgets['add-to-cart']):
+                response = self.client.post(reverse('add-to-cart'), {'product_id': product.id, 'quantity': 2}, format='json')
+            self.assertEqual(len(response.data['items']), size + 1)
+
+    def test_cart_batch(self):
+        cart = Cart.objects.create(user=self.user)
+        for size in self.sizes:
+            cart.items.set(self.make_items(size))
+            products = self.make_products(size)
+            operations = [{'op': 'add', 'product_id': product.id, 'quantity': 1} for product in products]
+            operations += [{'op': 'set', 'product_id': item.product_id, 'quantity': 5} for item in cart.items.all()[1:]]
+            operations.append({'op': 'remove', 'product_id': cart.items.first().product_id})
+            with self.assertQueryBudget(self.budgets['cart-batch']):
+                response = self.client.post(reverse('cart-batch'), {'operations': operations}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['items']), 2 * size - 1)
+
+    def test_order_list(self):
+        for size in self.sizes:
+            self.make_order(size)
+            self.make_order(size)
+            with self.assertQueryBudget(self.budgets['order-list']):
+                response = self.client.get(reverse('order-list'))
+            self.assertEqual(len(response.data[-1]['items']), size)
+
+    def test_order_history(self):
+        for size in self.sizes:
+            items = [{'product_id': product.id, 'quantity': 2} for product in self.make_products(size)]
+            self.client.post(reverse('order-list'), {'items': items}, format='json')
+            with self.assertQueryBudget(self.budgets['order-history']) as context:
+                response = self.client.get(reverse('order-history'))
+            self.assertFalse([query for query in context.captured_queries if 'core_product' in query['sql']])
+            self.assertEqual(len(response.data['results'][0]['lines']), size)
+
+    def test_order_history_snapshots_price(self):
+        product = self.make_products(1)[0]
+        self.client.post(reverse('order-list'), {'items': [{'product_id': product.id, 'quantity': 3}]}, format='json')
+        second = self.client.post(reverse('order-list'), {'items': [{'product_id': product.id, 'quantity': 1}]}, format='json')
+        Product.objects.filter(id=product.id).update(price=99, name='Renamed')
+
+        response = self.client.get(reverse('order-history'), {'page_size': 1})
+        self.assertEqual(response.data['results'][0]['id'], second.data['id'])
+        line = self.client.get(response.data['next']).data['results'][0]['lines'][0]
+        self.assertEqual((line['product_name'], line['unit_price'], line['line_total']), ('Product 0', '10.00', '30.00'))
+
+    def test_order_detail(self):
+        for size in self.sizes:
+            order = self.make_order(size)
+            with self.assertQueryBudget(self.budgets['order-detail']):
+                response = self.client.get(reverse('order-detail', args=[order.id]))
+            self.assertEqual(len(response.data['items']), size)
+
+    def test_order_create(self):
+        for size in self.sizes:
+            items = [{'product_id': product.id, 'quantity': 2} for product in self.make_products(size)]
+            budget = self.budgets['order-create']
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # One SELECT fetches the new CartItem ids, whatever the size.
+                budget += 1
+            with self.assertQueryBudget(budget):
+                response = self.client.post(reverse('order-list'), {'items': items}, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['items']), size)
+            self.assertEqual(response.data['total_price'], '%.2f' % (20 * size))
+
+    def test_not_modified(self):
+        Cart.objects.create(user=self.user)
+        order = self.make_order(3)
+        # Answering a revalidation costs at most the one validator query.
+        for url in (reverse('product-list'), reverse('product-detail', args=[order.items.first().product_id]),
+                    reverse('cart'), reverse('order-list'), reverse('order-detail', args=[order.id])):
+            etag = self.client.get(url)['ETag']
+            with self.assertQueryBudget(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_streamed_lists_match(self):
+        for size in (2, 3, 1):
+            self.make_order(size)
+        for url, query in ((reverse('order-list'), {}), (reverse('product-list'), {'fields': 'id,name'})):
+            expected = self.client.get(url, dict(query, page_size=200)).json()
+            response = self.client.get(url, dict(query, stream='1'))
+            with mock.patch('core.streaming.CHUNK_SIZE', 2):
+                chunks = list(self.client.get(url, dict(query, stream='1')).streaming_content)
+            self.assertTrue(response.streaming)
+            self.assertGreater(len(chunks), 3)
+            self.assertEqual(json.loads(b''.join(chunks)), expected['results'] if isinstance(expected, dict) else expected)
+
+    def test_cart_etag_follows_cart_writes(self):
+        product = self.make_products(1)[0]
+        self.client.post(reverse('add-to-cart'), {'product_id': product.id, 'quantity': 1}, format='json')
+        etag = self.client.get(reverse('cart'))['ETag']
+        with self.assertQueryBudget(1) as context:
+            self.assertEqual(self.client.get(reverse('cart'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotIn('core_cartitem', context.captured_queries[0]['sql'])
+
+        response = self.client.put(reverse('update-cart-item'), {'product_id': product.id, 'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('cart'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data['items'][0]['quantity']), (200, 3))
+
+    def test_update_cart_item_validates_quantity(self):
+        product = self.make_products(1)[0]
+        self.client.post(reverse('add-to-cart'), {'product_id': product.id, 'quantity': 1}, format='json')
+        for body in ({'product_id': product.id}, {'product_id': product.id, 'quantity': 'many'},
+                     {'product_id': product.id, 'quantity': 0}, {'quantity': 2}):
+            response = self.client.put(reverse('update-cart-item'), body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 1)
+
+    def test_add_to_cart_increments_line(self):
+        product = self.make_products(1)[0]
+        for _ in range(2):
+            response = self.client.post(reverse('add-to-cart'), {'product_id': product.id, 'quantity': 2}, format='json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual([(item['product']['id'], item['quantity']) for item in response.data['items']], [(product.id, 4)])
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 1)
+
+    def test_cart_batch_folds_operations(self):
+        kept, removed, readded = self.make_products(3)
+        self.client.post(reverse('add-to-cart'), {'product_id': removed.id, 'quantity': 1}, format='json')
+        operations = [
+            {'op': 'add', 'product_id': kept.id, 'quantity': 2},
+            {'op': 'add', 'product_id': kept.id, 'quantity': 3},
+            {'op': 'remove', 'product_id': removed.id},
+            {'op': 'add', 'product_id': readded.id, 'quantity': 1},
+            {'op': 'remove', 'product_id': readded.id},
+            {'op': 'add', 'product_id': readded.id, 'quantity': 4},
+        ]
+        response = self.client.post(reverse('cart-batch'), {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted((item['product']['id'], item['quantity']) for item in response.data['items']),
+                         [(kept.id, 5), (readded.id, 4)])
+
+        response = self.client.post(reverse('cart-batch'), {'operations': [
+            {'op': 'set', 'product_id': kept.id, 'quantity': 1},
+            {'op': 'add', 'product_id': 999, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartItem.objects.get(cart__user=self.user, product=kept).quantity, 5)
+
+    def test_register(self):
+        self.client.force_authenticate(None)
+        with self.assertQueryBudget(self.budgets['register']) as context:
+            response = self.client.post(reverse('register'), {
+                'username': 'newcomer', 'email': 'newcomer@EXAMPLE.com', 'password': 'password', 'user_type': 'seller',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        writes = [query['sql'] for query in context.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 2, writes)
+        user = User.objects.select_related('userprofile').get(username='newcomer')
+        self.assertEqual((user.email, user.userprofile.user_type), ('newcomer@example.com', 'seller'))
+        self.assertTrue(user.check_password('password'))
+
+    def test_user_save_writes_profile_only_when_changed(self):
+        user = User.objects.select_related('userprofile').get(id=self.user.id)
+        with self.assertQueryBudget(1):
+            user.save()
+        user.userprofile.user_type = 'hybrid'
+        with self.assertQueryBudget(2):
+            user.save()
+        self.assertEqual(UserProfile.objects.get(user=user).user_type, 'hybrid')
+
+    def test_order_list_is_deprecated(self):
+        response = self.client.get(reverse('order-list'))
+        self.assertEqual(response['Deprecation'], 'true')
+        self.assertIn(reverse('order-history'), response['Link'])
+        product = self.make_products(1)[0]
+        response = self.client.post(reverse('order-list'), {'items': [{'product_id': product.id, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Deprecation', response)
+
+    def test_order_create_unknown_product(self):
+        response = self.client.post(reverse('order-list'), {'items': [{'product_id': 999, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_order_create_without_items(self):
+        product = self.make_products(1)[0]
+        response = self.client.post(reverse('order-list'), {'items': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(reserve({}), [])
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 100)
+
+
+class ProductListTests(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        # Ties on price, so only the id keeps the order total.
+        self.products = [
+            Product.objects.create(name='Product %d' % i, description='Long text', price=i % 3 + 1, stock=5, seller=self.seller)
+            for i in range(9)
+        ]
+
+    def walk(self, response):
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(product['id'] for product in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_pages_are_stable_under_tied_prices(self):
+        by_price = [product.id for product in sorted(self.products, key=lambda product: (product.price, product.id))]
+        for ordering, expected in (('price', by_price), ('-price', by_price[::-1])):
+            response = self.client.get(reverse('product-list'), {'ordering': ordering, 'page_size': 2})
+            self.assertEqual(self.walk(response), expected)
+
+        # Rows inserted behind the cursor don't shift the pages after it.
+        first = self.client.get(reverse('product-list'), {'ordering': 'price', 'page_size': 4})
+        Product.objects.create(name='Cheap', description='', price=1, stock=5, seller=self.seller)
+        rest = self.walk(self.client.get(first.data['next']))
+        self.assertEqual([product['id'] for product in first.data['results']] + rest, by_price)
+
+    def test_invalid_cursor_ordering_and_page_size(self):
+        self.assertEqual(self.client.get(reverse('product-list'), {'cursor': 'not-a-cursor'}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('product-list'), {'ordering': 'name'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('product-list'), {'page_size': 0}).status_code, 400)
+        self.assertEqual(len(self.client.get(reverse('product-list'), {'page_size': 1000}).data['results']), 9)
+
+    def test_fields_projection(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('product-list'), {'fields': 'id,name', 'ordering': 'price', 'page_size': 3})
+        self.assertEqual([sorted(product) for product in response.data['results']], [['id', 'name']] * 3)
+        self.assertNotIn('description', context.captured_queries[-1]['sql'])
+        response = self.client.get(reverse('product-list'), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', str(response.data['fields']))
+
+
+class CatalogCacheTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.first, self.second = [
+            Product.objects.create(name='Product %d' % i, description='', price=10 + i, stock=5, seller=self.seller)
+            for i in range(2)
+        ]
+
+    def save(self, product, **changes):
+        for field, value in changes.items():
+            setattr(product, field, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+    def get(self, name, *args, **query):
+        response = self.client.get(reverse(name, args=args), query)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_product_change_only_drops_its_own_rows(self):
+        self.get('product-list')
+        self.get('product-detail', self.second.id)
+        self.save(Product.objects.get(id=self.first.id), stock=1)
+
+        with self.assertQueryBudget(0):
+            self.get('product-detail', self.second.id)
+        # The page of ids is still cached; only the changed row is loaded.
+        with self.assertQueryBudget(1):
+            results = self.get('product-list')['results']
+        self.assertEqual([product['stock'] for product in results], [1, 5])
+        self.assertEqual(self.get('product-detail', self.first.id)['stock'], 1)
+
+    def test_checkout_drops_only_the_rows_it_sold(self):
+        self.get('product-list')
+        self.get('product-detail', self.second.id)
+        buyer = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        self.client.force_authenticate(buyer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('order-list'), {'items': [{'product_id': self.first.id, 'quantity': 2}]}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        with self.assertQueryBudget(0):
+            self.get('product-detail', self.second.id)
+        with self.assertQueryBudget(1):
+            self.assertEqual([product['stock'] for product in self.get('product-list')['results']], [3, 5])
+
+    def test_price_change_reorders_lists(self):
+        self.assertEqual([product['id'] for product in self.get('product-list', ordering='price')['results']],
+                         [self.first.id, self.second.id])
+        self.save(Product.objects.get(id=self.first.id), price=99)
+        self.assertEqual([product['id'] for product in self.get('product-list', ordering='price')['results']],
+                         [self.second.id, self.first.id])
+
+    def test_detail_etag_follows_its_product(self):
+        etag = self.client.get(reverse('product-detail', args=[self.first.id]))['ETag']
+        self.save(Product.objects.get(id=self.second.id), stock=0)
+        response = self.client.get(reverse('product-detail', args=[self.first.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.save(Product.objects.get(id=self.first.id), name='Renamed')
+        response = self.client.get(reverse('product-detail', args=[self.first.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data['name'], 'Renamed')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_not_used(self):
+        for _ in range(2):
+            with self.assertQueryBudget(1):
+                response = self.client.get(reverse('product-detail', args=[self.first.id]))
+            self.assertFalse(response.has_header('ETag'))
+
+
+class SalesRollupTests(APITestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.seller.userprofile.user_type = 'seller'
+        self.seller.userprofile.save()
+        self.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        self.products = [
+            Product.objects.create(name='Product %d' % i, description='', price=10 * (i + 1), stock=100, seller=self.seller)
+            for i in range(2)
+        ]
+        self.client.force_authenticate(self.buyer)
+
+    def place_order(self, *quantities):
+        items = [{'product_id': product.id, 'quantity': quantity} for product, quantity in zip(self.products, quantities)]
+        return Order.objects.get(id=self.client.post(reverse('order-list'), {'items': items}, format='json').data['id'])
+
+    def snapshot(self):
+        return (
+            sorted(ProductSalesDaily.objects.values_list('product_id', 'day', 'units', 'revenue', 'orders')),
+            sorted(SellerSalesDaily.objects.values_list('seller_id', 'day', 'units', 'revenue', 'orders')),
+        )
+
+    def test_rollups_follow_status_changes(self):
+        first, second, third = self.place_order(1, 3), self.place_order(3), self.place_order(1, 1)
+        for order in (first, second, third):
+            order.update_status('completed')
+        first.update_status('completed')
+        third.update_status('cancelled')
+
+        today = timezone.now().date()
+        self.assertEqual(self.snapshot()[1], [(self.seller.id, today, 7, Decimal('100.00'), 2)])
+        incremental = self.snapshot()
+        rebuild_rollups()
+        self.assertEqual(self.snapshot(), incremental)
+
+        self.client.force_authenticate(self.seller)
+        response = self.client.get(reverse('seller-sales'))
+        self.assertEqual(response.data['totals'], {'units': 7, 'revenue': Decimal('100.00'), 'orders': 2})
+        self.assertEqual(response.data['top_products'][0]['product_id'], self.products[1].id)
+
+    def test_dashboard_is_for_sellers(self):
+        self.assertEqual(self.client.get(reverse('seller-sales')).status_code, 403)
+
+
+class OrderStateTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        self.product = Product.objects.create(name='Mug', description='', price=4, stock=100, seller=self.seller)
+        self.client.force_authenticate(self.buyer)
+
+    def place_order(self, quantity=1):
+        items = [{'product_id': self.product.id, 'quantity': quantity}]
+        return Order.objects.get(id=self.client.post(reverse('order-list'), {'items': items}, format='json').data['id'])
+
+    def test_changes_are_one_partial_write(self):
+        order = self.place_order()
+        with self.assertQueryBudget(1) as context:
+            order.update(payment_method='paypal', delivery_location='Nairobi')
+        self.assertNotIn('total_price', context.captured_queries[0]['sql'])
+        order.refresh_from_db()
+        self.assertEqual((order.payment_method, order.delivery_location), ('paypal', 'Nairobi'))
+        with self.assertRaises(ValueError):
+            order.set_payment_method('cheque')
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_admin_cannot_edit_status(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        order = self.place_order()
+        url = reverse('admin:core_order_change', args=[order.id])
+        response = self.client.get(url)
+        self.assertNotIn('status', response.context['adminform'].form.fields)
+        self.client.post(url, {'user': self.buyer.id, 'status': 'completed', 'total_price': '4.00'})
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+
+    def test_transitions_are_validated(self):
+        order = self.place_order()
+        order.update_status('cancelled')
+        with self.assertRaises(InvalidTransition):
+            order.update(status='completed', payment_method='paypal')
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_method), ('cancelled', None))
+
+    def test_total_is_summed_in_database(self):
+        order = self.place_order(quantity=3)
+        Order.objects.filter(id=order.id).update(total_price=0)
+        with self.assertQueryBudget(2):
+            order.calculate_total_price()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('12.00'))
+
+    def test_bulk_transition(self):
+        pending = [self.place_order() for _ in range(3)]
+        completed, cancelled = self.place_order(), self.place_order()
+        completed.update_status('completed')
+        cancelled.update_status('cancelled')
+        orders = Order.objects.all()
+
+        self.assertEqual(bulk_transition(orders, 'completed'), 3)
+        self.assertEqual(SellerSalesDaily.objects.get().orders, 4)
+        self.assertEqual(bulk_transition(orders, 'cancelled'), 4)
+        self.assertEqual(set(orders.values_list('status', flat=True)), {'cancelled'})
+        self.assertEqual(SellerSalesDaily.objects.get().orders, 0)
+
+    def test_completing_after_hold_expired(self):
+        restocked, sold_out = self.place_order(10), self.place_order(60)
+        release_expired(now=timezone.now() + timedelta(days=1))
+        self.place_order(80)
+
+        # 20 units are left: enough to take back the first hold, not the second.
+        with self.assertRaises(OutOfStock):
+            sold_out.update_status('completed')
+        sold_out.refresh_from_db()
+        self.assertEqual(sold_out.status, 'pending')
+        self.assertEqual(bulk_transition(Order.objects.filter(id__in=[restocked.id, sold_out.id]), 'completed'), 1)
+        self.assertEqual(Order.objects.get(id=sold_out.id).status, 'pending')
+        self.assertEqual(set(sold_out.reservations.values_list('status', flat=True)), {'expired'})
+        self.assertEqual(set(restocked.reservations.values_list('status', flat=True)), {'committed'})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+
+def flaky_task(fail_times):
+    if Job.objects.filter(status='running', attempts__lte=fail_times).exists():
+        raise RuntimeError('try again')
+
+
+class JobQueueTests(APITestCase):
+    def test_checkout_enqueues_post_order_work(self):
+        seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        product = Product.objects.create(name='Mug', description='', price=4, stock=10, seller=seller)
+        self.client.force_authenticate(User.objects.create_user('buyer', 'buyer@example.com', 'password'))
+        response = self.client.post(reverse('order-list'), {'items': [{'product_id': product.id, 'quantity': 1}]}, format='json')
+        order = Order.objects.get(id=response.data['id'])
+        self.assertIsNone(order.estimated_delivery_time)
+
+        enqueue('core.orders.after_order_placed', {'order_id': order.id}, key='order-placed:%d' % order.id)
+        jobs = claim('test', 10)
+        self.assertEqual([job.key for job in jobs], ['order-placed:%d' % order.id])
+        self.assertTrue(run_job(jobs[0]))
+        order.refresh_from_db()
+        self.assertEqual(order.estimated_delivery_time, order.created_at + timedelta(days=3))
+        self.assertEqual(claim('test', 10), [])
+
+    def test_retries_with_backoff_then_fails(self):
+        enqueue('core.tests.flaky_task', {'fail_times': 1}, max_attempts=3)
+        self.assertFalse(run_job(claim('test', 10)[0]))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('try again', job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertEqual(claim('test', 10), [])
+        self.assertTrue(run_job(claim('test', 10, now=job.run_at)[0]))
+        self.assertEqual(Job.objects.get().status, 'done')
+
+        enqueue('core.tests.flaky_task', {'fail_times': 5}, max_attempts=1)
+        self.assertFalse(run_job(claim('test', 10)[0]))
+        self.assertEqual(Job.objects.get(status='failed').attempts, 1)
+
+    def test_stale_jobs_are_requeued(self):
+        enqueue('core.tests.flaky_task', {'fail_times': 0})
+        claim('crashed', 10)
+        self.assertEqual(requeue_stale(), 0)
+        self.assertEqual(requeue_stale(now=timezone.now() + timedelta(hours=1)), 1)
+        self.assertEqual(Job.objects.get().status, 'queued')
+
+    def test_claim_update_has_no_limited_subquery(self):
+        # MariaDB and MySQL before 8.0.1 reject LIMIT in an IN subquery.
+        for i in range(3):
+            enqueue('core.tests.flaky_task', {'fail_times': 0}, key='job-%d' % i)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(len(claim('test', 2)), 2)
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('LIMIT', updates[0])
+
+
+class RunJobsCommandTests(TransactionTestCase):
+    # The command closes its connections as it goes, which would end a
+    # TestCase's transaction.
+    def test_runner_errors_do_not_stop_the_worker(self):
+        enqueue('core.tests.flaky_task', {'fail_times': 0})
+        enqueue('core.tests.flaky_task', {'fail_times': 0})
+        out = StringIO()
+        with mock.patch('core.management.commands.run_jobs.run_job', side_effect=DatabaseError), \
+                mock.patch('signal.signal'), self.assertLogs('core.management.commands.run_jobs') as logs:
+            call_command('run_jobs', once=True, workers=1, stdout=out)
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('Ran 2 job(s): 0 succeeded, 2 failed.', out.getvalue())
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+
+    def create(self, name, description=''):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(name=name, description=description, price=1, stock=1, seller=self.seller)
+
+    def ids(self, query, **kwargs):
+        return [product_id for product_id, score in search(query, **kwargs)]
+
+    def test_name_outranks_description(self):
+        in_description = self.create('Scarf', 'Red wool')
+        in_name = self.create('Wool hat', 'Warm')
+        in_both = self.create('Wool socks', 'Pure wool')
+        self.assertEqual(search('wool'), [(in_both.id, 4), (in_name.id, 3), (in_description.id, 1)])
+        self.assertEqual(self.ids('wool', offset=1, limit=1), [in_name.id])
+
+    def test_every_term_must_match(self):
+        red_hat = self.create('Red hat')
+        self.create('Blue hat')
+        self.create('Red scarf')
+        self.assertEqual(self.ids('red hat'), [red_hat.id])
+        self.assertEqual(self.ids('the hat of red'), [red_hat.id])
+        self.assertEqual(self.ids('green hat'), [])
+
+    def test_common_terms_are_read_to_a_fixed_depth(self):
+        hats = [self.create('Hat %d' % i) for i in range(5)]
+        rare = self.create('Hat', 'Tweed')
+        with mock.patch('core.search.MAX_CANDIDATES', 3):
+            # A rare term keeps the match exact however common the other is...
+            self.assertEqual(self.ids('tweed hat'), [rare.id])
+            # ...while a common term alone stops after its first postings.
+            self.assertEqual(self.ids('hat'), [product.id for product in [*hats, rare][:4]])
+
+    def test_index_follows_updates_and_deletes(self):
+        product = self.create('Wool hat')
+        product.name = 'Felt hat'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.ids('wool'), [])
+        self.assertEqual(self.ids('felt'), [product.id])
+
+        # Saves that leave the text alone don't touch the index.
+        product.price = 2
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            product.save(update_fields=['price'])
+
+        product.delete()
+        self.assertEqual(self.ids('felt'), [])
+        self.assertFalse(ProductSearchTerm.objects.exists())
+
+
+@override_settings(PRODUCT_IMAGE_SIZES=(128, 512, 1024))
+class ImageDerivativeTests(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        buffer = BytesIO()
+        Image.new('RGBA', (600, 300), (200, 30, 30, 128)).save(buffer, 'PNG')
+        self.name = default_storage.save('products/mug.png', ContentFile(buffer.getvalue()))
+        seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.product = Product.objects.create(name='Mug', description='', price=4, stock=1, seller=seller, image=self.name)
+
+    def test_derivatives_are_resized_without_upscaling(self):
+        derivatives = generate_derivatives(self.name)
+        self.assertEqual(derivatives['source'], self.name)
+        for key, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            # 600px wide: 1024 would be an upscale.
+            self.assertEqual(set(derivatives[key]), {'128', '512'})
+            with default_storage.open(derivatives[key]['128']) as f:
+                image = Image.open(f)
+                self.assertEqual((image.format, image.size), (pil_format, (128, 64)))
+        with default_storage.open(derivatives['jpeg']['512']) as f:
+            self.assertEqual(Image.open(f).mode, 'RGB')
+
+    def test_process_product_stores_the_map_once(self):
+        self.assertTrue(process_product(self.product.id))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_derivatives['source'], self.name)
+        self.assertTrue(default_storage.exists(self.product.image_derivatives['webp']['512']))
+        self.assertFalse(process_product(self.product.id))
+
+
+class ProductImportExportTests(APITestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.seller.userprofile.user_type = 'seller'
+        self.seller.userprofile.save()
+        self.client.force_authenticate(self.seller)
+
+    def test_csv_import_then_export(self):
+        body = (
+            'sku,name,description,price,stock\n'
+            'A-1,Leather jacket,Black leather,120.00,5\n'
+            'A-2,Wool scarf,Warm,cheap,5\n'
+            'A-3,Canvas bag,"Roomy,\nwith pockets",35.50,10\n'
+        )
+        response = self.client.post(reverse('product-import'), body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['error_count']), (2, 0, 1))
+        self.assertEqual(response.data['errors'][0]['row'], 2)
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertEqual([product_id for product_id, score in search('leather')], [Product.objects.get(sku='A-1').id])
+
+        body = '{"sku": "A-1", "name": "Leather jacket", "description": "Brown leather", "price": "99.00", "stock": 7}\nnot json\n'
+        response = self.client.post(reverse('product-import'), body, content_type='application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['error_count']), (0, 1, 1))
+        self.assertEqual(Product.objects.get(sku='A-1').price, Decimal('99.00'))
+
+        response = self.client.get(reverse('product-export'), {'file_format': 'csv'})
+        exported = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(exported, (
+            'sku,name,description,price,stock\r\n'
+            'A-1,Leather jacket,Brown leather,99.00,7\r\n'
+            'A-3,Canvas bag,"Roomy,\nwith pockets",35.50,10\r\n'
+        ))
+
+
+class CachedJWTAuthenticationTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        user_cache.local.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % AccessToken.for_user(self.user))
+
+    def test_user_is_cached(self):
+        self.client.get(reverse('profile'))
+        with self.assertQueryBudget(0):
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.data['username'], 'buyer')
+
+    def test_save_invalidates(self):
+        self.client.get(reverse('profile'))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+    def test_invalidation_from_another_worker(self):
+        self.client.get(reverse('profile'))
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        # Another process's cache: its own LRU, the same shared stamps.
+        UserCache().invalidate(self.user.id)
+        hits = user_cache.stats()['hits']
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+        self.assertEqual(user_cache.stats()['hits'], hits)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_not_used(self):
+        self.client.get(reverse('profile'))
+        with self.assertQueryBudget(1):
+            self.client.get(reverse('profile'))
+
+
+class TokenBlacklistTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        blacklist_filter.bloom = None
+        User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        response = self.client.post(reverse('login'), {'username': 'buyer', 'password': 'password'}, format='json')
+        self.refresh = response.data['refresh']
+
+    def test_rotated_token_is_rejected(self):
+        response = self.client.post(reverse('token-refresh'), {'refresh': self.refresh}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('token-refresh'), {'refresh': self.refresh}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_unlisted_token_skips_blacklist_query(self):
+        blacklist_filter.refresh()
+        with CaptureQueriesContext(connection) as context:
+            RefreshToken(self.refresh)
+        self.assertFalse([query for query in context.captured_queries if 'token_blacklist_blacklistedtoken' in query['sql']])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_fails_closed(self):
+        blacklist_filter.refresh()
+        # Blacklisted by another worker, which this one's cache never hears of.
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=RefreshToken(self.refresh)['jti']))
+        response = self.client.post(reverse('token-refresh'), {'refresh': self.refresh}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_compaction_deletes_expired_tokens(self):
+        token = RefreshToken(self.refresh)
+        token.blacklist()
+        self.assertEqual(compact_blacklist(batch_size=1), 0)
+        self.assertEqual(compact_blacklist(batch_size=1, now=timezone.now() + timedelta(days=2)), 1)
+        self.assertFalse(OutstandingToken.objects.exists())
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def write_snapshot(self, pid, requests):
+        with open(os.path.join(self.directory, 'metrics_%d.json' % pid), 'w') as f:
+            json.dump({'counters': [['http_requests_total', [['route', 'x']], requests]], 'histograms': []}, f)
+
+    def test_admin_only(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.client.force_authenticate(User.objects.create_user('buyer', 'buyer@example.com', 'password'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE http_requests_total counter', response.content)
+
+    def test_snapshots_of_dead_workers_are_removed(self):
+        worker = subprocess.Popen([sys.executable, '-c', ''])
+        worker.wait()
+        self.write_snapshot(worker.pid, 5)
+        self.write_snapshot(os.getppid(), 7)
+        with override_settings(METRICS={'MULTIPROCESS_DIR': self.directory}):
+            rendered = metrics_registry.render()
+            self.assertIn('http_requests_total{route="x"} 7\n', rendered)
+            self.assertEqual(
+                sorted(os.listdir(self.directory)),
+                sorted(['metrics_%d.json' % os.getppid(), 'metrics_%d.json' % os.getpid()]),
+            )
+            metrics_registry.remove_snapshot()
+            self.assertEqual(os.listdir(self.directory), ['metrics_%d.json' % os.getppid()])
+
+
+class QueryPlanTests(APITestCase):
+    """
+    EXPLAIN every query each endpoint issues against tables seeded past
+    `row_threshold` rows, and fail on full scans or sorts of that many rows.
+    """
+    row_threshold = 50
+    explained = ('SELECT', 'UPDATE', 'DELETE')
+
+    def setUp(self):
+        size = self.row_threshold + 10
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.seller.userprofile.user_type = 'seller'
+        self.seller.userprofile.save()
+        self.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        User.objects.bulk_create([User(username='user%d' % i, password='!') for i in range(size)])
+        others = list(User.objects.filter(username__startswith='user'))
+
+        Product.objects.bulk_create([
+            Product(name='Product %d' % i, description='Colour %d' % (i % 7), price=i % 13 + 1, stock=100,
+                    seller=self.seller, sku='SKU-%d' % i, image_derivatives={})
+            for i in range(2 * size)
+        ])
+        self.products = list(Product.objects.order_by('id'))
+        index_products(self.products)
+
+        Cart.objects.bulk_create([Cart(user=user) for user in others + [self.buyer]])
+        carts = Cart.objects.order_by('id')
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=1) for cart, product in zip(carts, self.products)
+        ])
+
+        Order.objects.bulk_create([
+            Order(user=self.buyer, status='completed' if i % 2 else 'pending', total_price=10) for i in range(size)
+        ])
+        self.orders = list(Order.objects.order_by('id'))
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, product=product, product_name=product.name, unit_price=10, quantity=1, line_total=10)
+            for order, product in zip(self.orders, self.products)
+        ])
+        StockReservation.objects.bulk_create([
+            StockReservation(product=product, order=order, quantity=1, status='committed', expires_at=timezone.now())
+            for order, product in zip(self.orders, self.products)
+        ])
+        rebuild_rollups()
+        OutstandingToken.objects.bulk_create([
+            OutstandingToken(user=user, jti=uuid.uuid4().hex, token='-', expires_at=timezone.now() + timedelta(days=1))
+            for user in others
+        ])
+
+    def endpoint_requests(self):
+        """
+        (URL name, user, request) for every endpoint, in an order that
+        leaves each request something to act on.
+        """
+        get, post, put, delete = self.client.get, self.client.post, self.client.put, self.client.delete
+        product, order = self.products[-1], self.orders[0]
+        refresh, logout_refresh = str(RefreshToken.for_user(self.buyer)), str(RefreshToken.for_user(self.buyer))
+        import_body = 'sku,name,description,price,stock\nSKU-1,Renamed,,12.00,3\nNEW-1,New,,5.00,1\n'
+        return [
+            ('metrics', self.admin, lambda: get(reverse('metrics'))),
+            ('register', None, lambda: post(reverse('register'), {
+                'username': 'newcomer', 'email': 'newcomer@example.com', 'password': 'password'}, format='json')),
+            ('login', None, lambda: post(reverse('login'), {'username': 'buyer', 'password': 'password'}, format='json')),
+            ('token-refresh', None, lambda: post(reverse('token-refresh'), {'refresh': refresh}, format='json')),
+            ('logout', self.buyer, lambda: post(reverse('logout'), {'refresh': logout_refresh}, format='json')),
+            ('profile', self.buyer, lambda: get(reverse('profile'))),
+            ('product-list', None, lambda: get(reverse('product-list'))),
+            ('product-list', None, lambda: get(reverse('product-list'), {'ordering': '-price', 'page_size': 10})),
+            ('product-list', None, lambda: get(reverse('product-list'), {'stream': 1})),
+            ('product-search', None, lambda: get(reverse('product-search'), {'q': 'colour 3'})),
+            ('product-detail', None, lambda: get(reverse('product-detail', args=[product.id]))),
+            ('product-import', self.seller, lambda: post(reverse('product-import'), import_body, content_type='text/csv')),
+            ('product-export', self.seller, lambda: get(reverse('product-export'), {'file_format': 'jsonl'})),
+            ('cart', self.buyer, lambda: get(reverse('cart'))),
+            ('add-to-cart', self.buyer, lambda: post(reverse('add-to-cart'), {'product_id': product.id, 'quantity': 1}, format='json')),
+            ('update-cart-item', self.buyer, lambda: put(reverse('update-cart-item'), {'product_id': product.id, 'quantity': 3}, format='json')),
+            ('cart-batch', self.buyer, lambda: post(reverse('cart-batch'), {'operations': [
+                {'op': 'add', 'product_id': self.products[1].id, 'quantity': 1},
+                {'op': 'set', 'product_id': self.products[2].id, 'quantity': 2},
+            ]}, format='json')),
+            ('remove-from-cart', self.buyer, lambda: delete(reverse('remove-from-cart'), {'product_id': self.products[1].id}, format='json')),
+            ('cart-item-remove', self.buyer, lambda: delete(reverse('cart-item-remove', args=[self.products[2].id]))),
+            ('order-list', self.buyer, lambda: post(reverse('order-list'), {'items': [{'product_id': product.id, 'quantity': 1}]}, format='json')),
+            ('order-list', self.buyer, lambda: get(reverse('order-list'))),
+            ('order-list', self.buyer, lambda: get(reverse('order-list'), {'stream': 1})),
+            ('order-history', self.buyer, lambda: get(reverse('order-history'), {'page_size': 10})),
+            ('order-detail', self.buyer, lambda: get(reverse('order-detail', args=[order.id]))),
+            ('seller-sales', self.seller, lambda: get(reverse('seller-sales'))),
+            ('cache-stats', self.admin, lambda: get(reverse('cache-stats'))),
+        ]
+
+    def row_count(self, table):
+        if table not in self.row_counts:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM %s' % connection.ops.quote_name(table))
+                self.row_counts[table] = cursor.fetchone()[0]
+        return self.row_counts[table]
+
+    def explain_sqlite(self, cursor, sql):
+        # EXPLAIN QUERY PLAN has no row estimates, so judge each scan by the
+        # size of the table it walks.
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        details = [row[-1] for row in cursor.fetchall()]
+        sorts = [detail for detail in details if detail.startswith('USE TEMP B-TREE')]
+        loops = [detail for detail in details if detail.startswith(('SCAN', 'SEARCH'))]
+        # Only the outermost loop, walking an index (or the rowid) in ORDER BY
+        # order with no sort after it, stops after a LIMIT; OFFSET still walks
+        # every skipped row, and inner loops run once per outer row.
+        ordered_walk = loops and ' ORDER BY ' in sql and ' LIMIT ' in sql and ' OFFSET ' not in sql and not sorts
+        problems = []
+        for detail in details:
+            match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+            if not match or match.group(1) not in self.tables:
+                continue
+            rows = self.row_count(match.group(1))
+            bounded = ordered_walk and detail is loops[0]
+            if rows > self.row_threshold and not bounded:
+                problems.append('%s (%d rows)' % (detail, rows))
+                problems.extend('%s (%d rows)' % (sort, rows) for sort in sorts)
+        return problems
+
+    def explain_mysql(self, cursor, sql):
+        cursor.execute('EXPLAIN ' + sql)
+        columns = [column[0] for column in cursor.description]
+        problems = []
+        for row in map(dict, (zip(columns, values) for values in cursor.fetchall())):
+            rows = row['rows'] or 0
+            if rows <= self.row_threshold:
+                continue
+            if row['type'] == 'ALL':
+                problems.append('full scan of %s (%d rows)' % (row['table'], rows))
+            if 'Using filesort' in (row['Extra'] or ''):
+                problems.append('filesort on %s (%d rows)' % (row['table'], rows))
+        return problems
+
+    def explain_postgresql(self, cursor, sql):
+        # Without these the planner prefers scans of the small test tables.
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('SET LOCAL enable_sort = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+        nodes = [cursor.fetchone()[0][0]['Plan']]
+        problems = []
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get('Plans', []))
+            if node['Node Type'] in ('Seq Scan', 'Sort') and node['Plan Rows'] > self.row_threshold:
+                problems.append('%s on %s (%d rows)' % (node['Node Type'], node.get('Relation Name', '-'), node['Plan Rows']))
+        return problems
+
+    def explain(self, sql):
+        explain = getattr(self, 'explain_%s' % connection.vendor, None)
+        if explain is None:
+            self.skipTest('No plan checks for %s.' % connection.vendor)
+        with connection.cursor() as cursor:
+            return explain(cursor, sql)
+
+    def test_no_endpoint_scans_or_sorts_large_tables(self):
+        self.tables = set(connection.introspection.table_names())
+        for name, user, request in self.endpoint_requests():
+            with self.subTest(endpoint=name):
+                self.client.force_authenticate(user)
+                catalog_cache.invalidate_all()
+                with CaptureQueriesContext(connection) as context:
+                    response = request()
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+                # Counts change as requests write, so measure afresh.
+                self.row_counts = {}
+                problems = [
+                    '%s\n    %s' % (query['sql'], '\n    '.join(found))
+                    for query in context.captured_queries
+                    if query['sql'].lstrip().upper().startswith(self.explained)
+                    for found in [self.explain(query['sql'])] if found
+                ]
+                if problems:
+                    self.fail('%s issued queries that read too many rows:\n%s' % (name, '\n'.join(problems)))
+
+    @skipUnless(connection.vendor == 'sqlite', 'Checks the SQLite plan reader.')
+    def test_limit_only_bounds_ordered_index_walks(self):
+        self.tables = set(connection.introspection.table_names())
+        self.row_counts = {}
+        table = Product._meta.db_table
+        self.assertEqual(self.explain('SELECT id FROM %s ORDER BY id LIMIT 10' % table), [])
+        self.assertTrue(self.explain('SELECT id FROM %s ORDER BY id LIMIT 10 OFFSET 100' % table))
+        self.assertTrue(self.explain('SELECT id FROM %s WHERE stock > 0 LIMIT 10' % table))
+        self.assertTrue(self.explain('SELECT id FROM %s ORDER BY stock LIMIT 10' % table))
+
+    def test_every_endpoint_is_covered(self):
+        named = {pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern) and pattern.name}
+        covered = {name for name, user, request in self.endpoint_requests()}
+        self.assertEqual(named - covered, set(), 'Add requests for these endpoints to endpoint_requests().')
+
+
+@skipUnless('replica' in settings.DATABASES, 'Run with --settings=ecommerce.test_settings.')
+@override_settings(DATABASE_REPLICAS=dict(settings.DATABASE_REPLICAS, READ_ROUTES=['product-detail', 'order-history']))
+class ReplicaRoutingTests(APITransactionTestCase):
+    # Nothing replicates between the two SQLite files, so a read shows which
+    # database served it.
+    databases = '__all__'
+
+    def setUp(self):
+        replica_monitor.reset()
+        caches['default'].clear()
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        self.product = Product.objects.create(name='Lamp', description='', price=10, stock=5, seller=self.seller)
+        for model in (User, UserProfile, Product):
+            model.objects.using('replica').bulk_create(model.objects.using('default').all())
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % AccessToken.for_user(self.buyer))
+
+    def get_product_name(self):
+        # Catalog cache fills read from the primary, so route around it.
+        with mock.patch.object(type(catalog_cache), 'enabled', new_callable=mock.PropertyMock, return_value=False):
+            return self.client.get(reverse('product-detail', args=[self.product.id])).data['name']
+
+    def test_safe_reads_use_replica(self):
+        Product.objects.filter(id=self.product.id).update(name='Desk lamp')
+        self.assertEqual(self.get_product_name(), 'Lamp')
+        self.assertEqual(replica_monitor.stats()['reads'], {'replica': 1})
+
+    def test_writer_reads_own_writes(self):
+        response = self.client.post(reverse('order-list'), {'items': [{'product_id': self.product.id, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.client.get(reverse('order-history')).data['results']), 1)
+
+        caches['default'].delete(sticky_key(self.buyer.id))
+        self.assertEqual(self.client.get(reverse('order-history')).data['results'], [])
+        self.assertEqual(replica_monitor.stats()['reads'], {'sticky': 1, 'replica': 1})
+
+    def test_lagging_or_unreachable_replica_is_skipped(self):
+        Product.objects.filter(id=self.product.id).update(name='Desk lamp')
+        with mock.patch.object(replica_monitor, 'lag', return_value=30):
+            self.assertEqual(self.get_product_name(), 'Desk lamp')
+        replica_monitor.reset()
+        with mock.patch.object(replica_monitor, 'lag', side_effect=DatabaseError):
+            self.assertEqual(self.get_product_name(), 'Desk lamp')
+        self.assertEqual(replica_monitor.stats(), {'reads': {'lagging': 1}, 'lags': {'replica': None}})
+
+    def test_catalog_cache_fills_from_primary(self):
+        Product.objects.filter(id=self.product.id).update(name='Desk lamp')
+        catalog_cache.invalidate([self.product.id])
+        url = reverse('product-detail', args=[self.product.id])
+        self.assertEqual(self.client.get(url).data['name'], 'Desk lamp')
+        self.assertEqual(self.client.get(url).data['name'], 'Desk lamp')
+
+
+class AsyncReadPathTests(APITransactionTestCase):
+    # The executor threads use their own connections, so the rows must be
+    # committed for them to see.
+    def setUp(self):
+        caches['default'].clear()
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.seller.userprofile.user_type = 'seller'
+        self.seller.userprofile.save()
+        self.product = Product.objects.create(name='Lamp', description='', price=10, stock=5, seller=self.seller)
+        self.factory = AsyncRequestFactory()
+        self.threads = []
+
+    def record_thread(self, call):
+        def wrapper(*args, **kwargs):
+            self.threads.append(threading.current_thread().name)
+            return call(*args, **kwargs)
+        return mock.patch.object(async_views, '_call', wrapper)
+
+    def test_reads_run_side_by_side_on_the_executor(self):
+        # Both reads have to be in their views at once to pass the barrier.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def detail(request, id):
+            barrier.wait()
+            return views.ProductDetailView.as_view()(request, id=id)
+
+        async def read_twice():
+            return await asyncio.gather(*(
+                async_views.run_in_executor(detail, self.factory.get('/api/products/%d/' % self.product.id), id=self.product.id)
+                for _ in range(2)
+            ))
+
+        with self.record_thread(async_views._call):
+            responses = async_to_sync(read_twice)()
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(len(set(self.threads)), 2)
+        self.assertTrue(all(name.startswith('orm') for name in self.threads))
+
+    def test_read_views(self):
+        token = 'Bearer %s' % AccessToken.for_user(self.seller)
+        requests = [
+            (async_views.product_list, self.factory.get('/api/products/'), {}),
+            (async_views.product_search, self.factory.get('/api/products/search/?q=lamp'), {}),
+            (async_views.product_detail, self.factory.get('/api/products/%d/' % self.product.id), {'id': self.product.id}),
+            (async_views.cart, self.factory.get('/api/cart/', authorization=token), {}),
+        ]
+        with self.record_thread(async_views._call):
+            for view, request, kwargs in requests:
+                response = async_to_sync(view)(request, **kwargs)
+                self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(self.threads), len(requests))
+        self.assertEqual(json.loads(response.content)['user'], self.seller.id)
+
+    def test_streamed_body_is_not_buffered(self):
+        for i in range(3):
+            Product.objects.create(name='Chair %d' % i, description='', price=5, stock=1, seller=self.seller)
+        events = []
+
+        def chunks(*args, **kwargs):
+            for chunk in iterate_chunks(*args, **kwargs):
+                events.append('chunk')
+                yield chunk
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            events.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/products/', 'query_string': b'stream=1', 'headers': []}
+        # The async views are only routed under ASGI; resolvers take any
+        # hashable sequence of patterns.
+        urlconf = (path('api/products/', async_views.product_list, name='product-list'),)
+        with override_settings(ROOT_URLCONF=urlconf), mock.patch('core.streaming.CHUNK_SIZE', 1), \
+                mock.patch('core.views.iterate_chunks', chunks):
+            async_to_sync(async_views.ASGIHandler())(scope, receive, send)
+
+        self.assertEqual(events[0]['status'], 200)
+        bodies = [event for event in events if event != 'chunk' and event['type'] == 'http.response.body']
+        self.assertEqual(len(json.loads(b''.join(body.get('body', b'') for body in bodies))), 4)
+        # The first rows were sent before the later chunks were even loaded.
+        self.assertLess(events.index(bodies[1]), len(events) - 1 - events[::-1].index('chunk'))
+        self.assertGreater(len(bodies), 4)
+
+    def test_writes_keep_the_sync_path(self):
+        request = self.factory.post(
+            '/api/products/', urlencode({'name': 'Desk', 'description': 'Oak', 'price': '30.00', 'stock': 1}),
+            content_type='application/x-www-form-urlencoded', authorization='Bearer %s' % AccessToken.for_user(self.seller),
+        )
+        with self.record_thread(async_views._call):
+            response = async_to_sync(async_views.product_list)(request)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.threads, [])
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.broken = False
+
+    def ping(self):
+        if self.broken:
+            raise DatabaseError('gone away')
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, **options):
+        options = dict({'max_size': 2, 'max_lifetime': 60, 'pre_ping_after': 60, 'timeout': 0.01}, **options)
+        return ConnectionPool('test', FakeConnection.ping, lambda connection: setattr(connection, 'closed', True), **options)
+
+    def test_connections_are_reused_up_to_max_size(self):
+        pool = self.make_pool()
+        first, second = pool.acquire(FakeConnection), pool.acquire(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(FakeConnection)
+        pool.release(first)
+        self.assertIs(pool.acquire(FakeConnection), first)
+        self.assertEqual(pool.stats(), {
+            'idle': 0, 'in_use': 2, 'created': 2, 'closed': {'lifetime': 0, 'ping': 0, 'discarded': 0}, 'timeouts': 1,
+        })
+
+    def test_waiter_gets_released_connection(self):
+        pool = self.make_pool(max_size=1, timeout=5)
+        connection = pool.acquire(FakeConnection)
+        timer = threading.Timer(0.05, pool.release, [connection])
+        timer.start()
+        self.assertIs(pool.acquire(FakeConnection), connection)
+        timer.join()
+
+    def test_old_dead_or_dirty_connections_are_replaced(self):
+        pool = self.make_pool(max_lifetime=0)
+        connection = pool.acquire(FakeConnection)
+        pool.release(connection)
+        self.assertTrue(connection.closed)
+
+        pool = self.make_pool(pre_ping_after=0)
+        connection = pool.acquire(FakeConnection)
+        pool.release(connection)
+        connection.broken = True
+        self.assertIsNot(pool.acquire(FakeConnection), connection)
+        self.assertTrue(connection.closed)
+
+        dirty = pool.acquire(FakeConnection)
+        pool.release(dirty, discard=True)
+        self.assertTrue(dirty.closed)
+        self.assertEqual(pool.stats()['closed'], {'lifetime': 0, 'ping': 1, 'discarded': 1})
+
+
+class StockReservationConcurrencyTests(TransactionTestCase):
+    checkouts = 200
+    stock = 50
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Concurrent writers need a file-backed SQLite database.')
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.product = Product.objects.create(name='Flash sale', description='', price=1, stock=self.stock, seller=self.seller)
+
+    def checkout(self, barrier, results):
+        barrier.wait()
+        try:
+            reserve({self.product.id: 1})
+            results.append(True)
+        except InsufficientStock:
+            results.append(False)
+        finally:
+            connections.close_all()
+
+    def test_concurrent_checkouts_never_oversell(self):
+        barrier = threading.Barrier(self.checkouts)
+        results = []
+        threads = [threading.Thread(target=self.checkout, args=(barrier, results)) for _ in range(self.checkouts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), self.checkouts)
+        self.assertEqual(results.count(True), self.stock)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(StockReservation.objects.filter(status='held').count(), self.stock)
+
+        released = release_expired(batch_size=7, now=timezone.now() + timedelta(days=1))
+        self.assertEqual(released, self.stock)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, self.stock)
+        self.assertFalse(StockReservation.objects.filter(status='held').exists())
@@ -0,0 +1,207 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from ecommerce.metrics import registry
+from .cache import is_shared
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings: no false negatives, false
+    positives at about `error_rate` while it holds at most `capacity` keys.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BlacklistFilter:
+    """
+    Per-process Bloom filter of the jtis of unexpired blacklisted tokens, so
+    a refresh token that was never blacklisted is accepted without a query.
+
+    Each blacklisting bumps a version counter in the shared cache and stores
+    its jti under the new version. Processes compare the counter on every
+    check and pull just the missing jtis; if any are gone from the cache, or
+    the filter is full or older than REBUILD_INTERVAL, it is rebuilt from
+    the database, which also drops expired tokens.
+
+    A process-local cache would hide other workers' blacklistings, so with
+    one the filter fails closed and every check goes to the database.
+    """
+    version_key = 'token_blacklist:version'
+    max_catch_up = 1000
+
+    def __init__(self):
+        options = getattr(settings, 'TOKEN_BLACKLIST_FILTER', {})
+        self.alias = options.get('CACHE_ALIAS', 'default')
+        self.error_rate = options.get('ERROR_RATE', 0.001)
+        self.rebuild_interval = options.get('REBUILD_INTERVAL', 600)
+        self._lock = threading.Lock()
+        self.bloom = None
+        self.version = 0
+        self.built_at = 0
+        self.skipped = 0
+        self.checked = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def jti_key(self, version):
+        return 'token_blacklist:jti:%d' % version
+
+    def rebuild(self):
+        version = self.shared.get(self.version_key, 0)
+        jtis = list(BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list('token__jti', flat=True))
+        bloom = BloomFilter(max(2 * len(jtis), 1024), self.error_rate)
+        for jti in jtis:
+            bloom.add(jti)
+        self.bloom, self.version, self.built_at = bloom, version, time.monotonic()
+        self.rebuilds += 1
+
+    def catch_up(self, version):
+        keys = [self.jti_key(v) for v in range(self.version + 1, version + 1)]
+        jtis = self.shared.get_many(keys)
+        if len(jtis) != len(keys) or self.bloom.count + len(jtis) > self.bloom.capacity:
+            self.rebuild()
+            return
+        for jti in jtis.values():
+            self.bloom.add(jti)
+        self.version = version
+
+    def refresh(self):
+        version = self.shared.get(self.version_key, 0)
+        if self.bloom is None or time.monotonic() - self.built_at > self.rebuild_interval:
+            self.rebuild()
+        elif version < self.version or version - self.version > self.max_catch_up:
+            # The counter was reset (cache flush) or we're too far behind.
+            self.rebuild()
+        elif version > self.version:
+            self.catch_up(version)
+
+    def might_contain(self, jti):
+        with self._lock:
+            if not is_shared(self.shared):
+                self.checked += 1
+                return True
+            self.refresh()
+            found = jti in self.bloom
+            if found:
+                self.checked += 1
+            else:
+                self.skipped += 1
+            return found
+
+    def add(self, jti):
+        with self._lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+        def publish():
+            try:
+                version = self.shared.incr(self.version_key)
+            except ValueError:
+                self.shared.add(self.version_key, 0, None)
+                version = self.shared.incr(self.version_key)
+            self.shared.set(self.jti_key(version), jti, self.rebuild_interval * 2)
+        transaction.on_commit(publish)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'skipped': self.skipped,
+                'checked': self.checked,
+                'false_positives': self.false_positives,
+                'rebuilds': self.rebuilds,
+                'entries': self.bloom.count if self.bloom is not None else 0,
+            }
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class RefreshToken(tokens.RefreshToken):
+    """
+    RefreshToken that consults blacklist_filter before the blacklist table.
+    """
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if not blacklist_filter.might_contain(jti):
+            return
+        super().check_blacklist()
+        blacklist_filter.false_positives += 1
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+def compact_blacklist(batch_size=1000, now=None, pause=0):
+    """
+    Delete expired outstanding tokens and their blacklist entries, one short
+    transaction per batch of ids. Returns the number of tokens deleted.
+    """
+    now = now or timezone.now()
+    deleted = 0
+    last_id = 0
+    while True:
+        # Walk the primary key so each batch starts where the last one ended
+        # instead of rescanning from the oldest row.
+        ids = list(OutstandingToken.objects.filter(id__gt=last_id, expires_at__lte=now)
+                   .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            OutstandingToken.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        last_id = ids[-1]
+        if pause:
+            time.sleep(pause)
+
+
+def collect_blacklist_filter_metrics():
+    stats = blacklist_filter.stats()
+    yield 'token_blacklist_checks_total', {'result': 'skipped'}, stats['skipped']
+    yield 'token_blacklist_checks_total', {'result': 'checked'}, stats['checked']
+    yield 'token_blacklist_false_positives_total', {}, stats['false_positives']
+    yield 'token_blacklist_filter_rebuilds_total', {}, stats['rebuilds']
+    yield 'token_blacklist_filter_entries', {}, stats['entries']
+
+
+registry.describe('token_blacklist_checks_total', 'counter', 'Refresh token blacklist checks, by whether the filter skipped the query.')
+registry.describe('token_blacklist_false_positives_total', 'counter', 'Filter matches the blacklist table did not confirm.')
+registry.describe('token_blacklist_filter_rebuilds_total', 'counter', 'Rebuilds of the blacklist filter from the database.')
+registry.describe('token_blacklist_filter_entries', 'gauge', 'Jtis in the blacklist filter.')
+registry.register_collector(collect_blacklist_filter_metrics)
@@ -1,17 +1,75 @@
 from django.shortcuts import render
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken , AccessToken
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.views import TokenRefreshView as BaseTokenRefreshView
+from .tokens import RefreshToken, blacklist_filter
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
+from rest_framework.exceptions import ValidationError
 from django.contrib.auth import authenticate
-from .models import Product, Cart, CartItem, Order, UserProfile
+from django.db import transaction
+from django.db.models import Prefetch, Sum, prefetch_related_objects
+from django.urls import reverse
+from django.utils import timezone
+from datetime import date, timedelta
+from decimal import Decimal
+from .models import Product, Cart, CartItem, Order, UserProfile, ProductSalesDaily, SellerSalesDaily
+from .permissions import IsSeller
 from rest_framework.parsers import MultiPartParser, FormParser
+from .pagination import KeysetPagination
+from .cache import catalog_cache
+from .authentication import user_cache
+from .db import upsert
+from .carts import apply_operations, touch, UnknownProducts
+from .conditional import conditional, catalog_validator, product_validator, cart_validator, order_list_validator, order_validator
+from .search import search
+from .streaming import StreamingJSONResponse, iterate_chunks, wants_stream
+from .product_io import FORMATS, read_rows, decode_lines, import_products, export_products
+from rest_framework.utils.urls import replace_query_param
+from ecommerce.metrics import registry
+import csv
 import logging
 logger = logging.getLogger(__name__)
-from .serializers import UserSerializer, ProductSerializer, CartSerializer, OrderSerializer, CartItemSerializer, UserProfileSerializer
+from .serializers import UserSerializer, ProductSerializer, CartSerializer, CartBatchSerializer, CartItemQuantitySerializer, OrderSerializer, OrderHistorySerializer, CartItemSerializer, UserProfileSerializer, TokenRefreshSerializer
+
+def requested_product_fields(request):
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = set(fields) - set(ProductSerializer.Meta.fields)
+    if unknown:
+        raise ValidationError({'fields': 'Unknown field(s): %s.' % ', '.join(sorted(unknown))})
+    return fields
+
+def product_columns(fields):
+    # Serializer field names aren't always column names (images -> image_derivatives).
+    serializer_fields = ProductSerializer().fields
+    return [serializer_fields[field].source for field in fields]
+
+def product_rows(request, ids, fields=None):
+    """
+    Serialized products for `ids`, in that order, each cached under its own
+    version so a change to one product re-renders only its rows.
+    """
+    def load(missing):
+        products = Product.objects.all()
+        if fields is not None:
+            products = products.only('id', *product_columns(fields))
+        products = products.in_bulk(missing)
+        serializer = ProductSerializer(list(products.values()), many=True, fields=fields, context={'request': request})
+        return dict(zip(products, serializer.data))
+
+    rows = catalog_cache.get_products(ids, load, fields, request.build_absolute_uri('/'))
+    return [rows[product_id] for product_id in ids if product_id in rows]
+
+def items_prefetch():
+    # Cart and order payloads nest each item's product; load them in one query.
+    return Prefetch('items', queryset=CartItem.objects.select_related('product'))
 
 class RegisterView(APIView):
     permission_classes = [AllowAny]
@@ -20,17 +78,17 @@ class RegisterView(APIView):
         serializer = UserSerializer(data=request.data)
         
         if serializer.is_valid():
-            user = User.objects.create_user(
-                username=serializer.validated_data['username'],
-                email=serializer.validated_data['email'],
-                password=request.data.get('password') 
-            )
-            
-            user_profile = UserProfile.objects.create(
-                user=user,
-                user_type=request.data.get('user_type', 'buyer') 
+            user = User(
+                username=User.normalize_username(serializer.validated_data['username']),
+                email=User.objects.normalize_email(serializer.validated_data['email']),
             )
-            
+            user.set_password(request.data.get('password'))
+            # create_user_profile inserts the attached profile along with the
+            # user: two INSERTs, and neither row exists without the other.
+            user_profile = user.userprofile = UserProfile(user_type=request.data.get('user_type', 'buyer'))
+            with transaction.atomic():
+                user.save()
+
             user_data = serializer.data
             user_data['user_profile'] = UserProfileSerializer(user_profile).data
             return Response(user_data, status=status.HTTP_201_CREATED)
@@ -79,6 +137,9 @@ class LogoutView(APIView):
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+class TokenRefreshView(BaseTokenRefreshView):
+    serializer_class = TokenRefreshSerializer
+
 class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -115,10 +176,30 @@ class ProductListView(APIView):
     permission_classes = [AllowAny]
     parser_classes = [MultiPartParser, FormParser]
 
-    def get(self, request):
+    def get_page(self, request):
+        # Only the ids; their rows come from product_rows().
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(Product.objects.only('id', *paginator.get_ordering_fields(request)), request)
+        return paginator.get_paginated_data([product.id for product in page])
+
+    def stream(self, request):
+        fields = requested_product_fields(request)
         products = Product.objects.all()
-        serializer = ProductSerializer(products, many=True, context={'request': request})
-        return Response(serializer.data)
+        if fields is not None:
+            products = products.only('id', *product_columns(fields))
+        return StreamingJSONResponse(
+            iterate_chunks(products),
+            lambda chunk: ProductSerializer(chunk, many=True, fields=fields, context={'request': request}).data,
+        )
+
+    @conditional(catalog_validator)
+    def get(self, request):
+        if wants_stream(request):
+            return self.stream(request)
+        fields = requested_product_fields(request)
+        key = catalog_cache.make_key('lists', request.build_absolute_uri())
+        page = catalog_cache.get_or_set(key, lambda: self.get_page(request))
+        return Response(dict(page, results=product_rows(request, page['results'], fields)))
 
     def post(self, request):
         serializer = ProductSerializer(data=request.data, context={'request': request})
@@ -127,13 +208,82 @@ class ProductListView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class ProductImportView(APIView):
+    permission_classes = [IsAuthenticated, IsSeller]
+    # The body is read as a stream below, never parsed into memory.
+    parser_classes = []
+    content_types = {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'jsonl',
+        'application/jsonl': 'jsonl',
+    }
+
+    def post(self, request):
+        # Not ?format=, which DRF reserves for picking a renderer.
+        content_type = request.content_type.split(';')[0].strip()
+        format = request.query_params.get('file_format') or self.content_types.get(content_type)
+        if format not in FORMATS:
+            return Response({'detail': 'Send text/csv or application/x-ndjson, or pass ?file_format=csv|jsonl.'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        try:
+            rows = read_rows(decode_lines(request._request), format)
+            report = import_products(request.user, rows)
+        except UnicodeDecodeError:
+            return Response({'detail': 'The body must be UTF-8.'}, status=status.HTTP_400_BAD_REQUEST)
+        except csv.Error as e:
+            return Response({'detail': 'Malformed CSV: %s' % e}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+class ProductExportView(APIView):
+    permission_classes = [IsAuthenticated, IsSeller]
+    content_types = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+    def get(self, request):
+        format = request.query_params.get('file_format', 'csv')
+        if format not in FORMATS:
+            raise ValidationError({'file_format': 'Must be one of: %s.' % ', '.join(FORMATS)})
+        response = StreamingHttpResponse(export_products(request.user, format), content_type=self.content_types[format])
+        response['Content-Disposition'] = 'attachment; filename="products.%s"' % format
+        return response
+
+class ProductSearchView(APIView):
+    permission_classes = [AllowAny]
+    page_size = 20
+    max_page_size = 100
+
+    def get_page(self, request, query):
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            raise ValidationError({'detail': 'page and page_size must be integers.'})
+
+        matches = search(query, offset=(page - 1) * page_size, limit=page_size + 1)
+        next_link = None
+        if len(matches) > page_size:
+            next_link = replace_query_param(request.build_absolute_uri(), 'page', page + 1)
+        # Only the ids; their rows come from product_rows().
+        return {'next': next_link, 'results': [product_id for product_id, score in matches[:page_size]]}
+
+    @conditional(catalog_validator)
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"detail": "Query parameter q is required"}, status=status.HTTP_400_BAD_REQUEST)
+        fields = requested_product_fields(request)
+        key = catalog_cache.make_key('search', request.build_absolute_uri())
+        page = catalog_cache.get_or_set(key, lambda: self.get_page(request, query))
+        return Response(dict(page, results=product_rows(request, page['results'], fields)))
+
 class ProductDetailView(APIView):
     permission_classes = [AllowAny]
 
+    @conditional(product_validator)
     def get(self, request, id):
-        product = Product.objects.get(id=id)
-        serializer = ProductSerializer(product, context={'request': request})
-        return Response(serializer.data)
+        rows = product_rows(request, [id])
+        if not rows:
+            return Response({"detail": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(rows[0])
 
     def put(self, request, id):
         product = Product.objects.get(id=id)
@@ -151,8 +301,10 @@ class ProductDetailView(APIView):
 class CartView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @conditional(cart_validator)
     def get(self, request):
         cart, created = Cart.objects.get_or_create(user=request.user)
+        prefetch_related_objects([cart], items_prefetch())
         serializer = CartSerializer(cart, context={'request': request})
         return Response(serializer.data)
 
@@ -164,8 +316,9 @@ class AddToCartView(APIView):
             product_id = request.data.get('product_id')
             quantity = request.data.get('quantity')
 
-            if not product_id or not quantity:
+            if not product_id or not str(quantity).isdigit() or int(quantity) < 1:
                 return Response({"detail": "Invalid data"}, status=status.HTTP_400_BAD_REQUEST)
+            quantity = int(quantity)
 
             try:
                 product = Product.objects.get(id=product_id)
@@ -173,16 +326,11 @@ class AddToCartView(APIView):
                 return Response({"detail": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
 
             cart, created = Cart.objects.get_or_create(user=request.user)
-            cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-
-            if not created:
-                cart_item.quantity += quantity
-            else:
-                cart_item.quantity = quantity
-            cart_item.save()
-
-            cart.items.add(cart_item)
+            # One statement whether or not the product is already in the cart.
+            upsert(CartItem, [{'cart': cart.id, 'product': product.id, 'quantity': quantity}], ['cart', 'product'], increment=['quantity'])
+            touch(cart)
 
+            prefetch_related_objects([cart], items_prefetch())
             serializer = CartSerializer(cart, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except Product.DoesNotExist:
@@ -192,34 +340,57 @@ class AddToCartView(APIView):
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class CartBatchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        try:
+            apply_operations(cart, serializer.validated_data['operations'])
+        except UnknownProducts as e:
+            return Response({'operations': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        prefetch_related_objects([cart], items_prefetch())
+        return Response(CartSerializer(cart, context={'request': request}).data)
+
+
 class UpdateCartItemView(APIView):
     permission_classes = [IsAuthenticated]
 
     def put(self, request):
-        cart = Cart.objects.get(user=request.user)
-        product_id = request.data.get('product_id')
-        quantity = request.data.get('quantity')
-        cart_item = CartItem.objects.get(product_id=product_id)
-        cart_item.quantity = quantity
-        cart_item.save()
+        serializer = CartItemQuantitySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            cart = Cart.objects.get(user=request.user)
+        except Cart.DoesNotExist:
+            return Response({'error': 'Cart not found'}, status=status.HTTP_404_NOT_FOUND)
+        product_id = serializer.validated_data['product_id']
+        if not cart.items.filter(product_id=product_id).update(quantity=serializer.validated_data['quantity']):
+            return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
+        touch(cart)
+        prefetch_related_objects([cart], items_prefetch())
         serializer = CartSerializer(cart, context={'request': request})
         return Response(serializer.data)
 
 class RemoveFromCartView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def delete(self, request, product_id):
+    def delete(self, request, product_id=None):
+        # Routed without a product_id in the URL, so it comes in the body.
+        if product_id is None:
+            product_id = request.data.get('product_id')
         try:
             cart = Cart.objects.get(user=request.user)
-            cart_item = CartItem.objects.get(cart=cart, product_id=product_id)
-            cart.items.remove(cart_item)
-            cart_item.delete()
+            deleted, _ = cart.items.filter(product_id=product_id).delete()
+            if not deleted:
+                return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
+            touch(cart)
+            prefetch_related_objects([cart], items_prefetch())
             serializer = CartSerializer(cart, context={'request': request})
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Cart.DoesNotExist:
             return Response({'error': 'Cart not found'}, status=status.HTTP_404_NOT_FOUND)
-        except CartItem.DoesNotExist:
-            return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
 
 class CartItemDeleteView(APIView):
     permission_classes = [IsAuthenticated]
@@ -233,15 +404,11 @@ class CartItemDeleteView(APIView):
             product = Product.objects.get(id=product_id)
             
             
-            cart_items = CartItem.objects.filter(product=product)
+            deleted, _ = cart.items.filter(product=product).delete()
             
-            if not cart_items.exists():
+            if not deleted:
                 return Response({"detail": "Cart item not found."}, status=status.HTTP_404_NOT_FOUND)
-            
-            
-            for cart_item in cart_items:
-                cart.items.remove(cart_item)
-                cart_item.delete()
+            touch(cart)
             
             return Response({"detail": "Cart item(s) removed."}, status=status.HTTP_200_OK)
         
@@ -257,23 +424,53 @@ class CartItemDeleteView(APIView):
 class OrderListView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method == 'GET':
+            # Deprecated: this prices items from the live products and returns
+            # every order at once. order-history reads the line snapshots and
+            # is paginated.
+            response['Deprecation'] = 'true'
+            response['Link'] = '<%s>; rel="successor-version"' % request.build_absolute_uri(reverse('order-history'))
+        return response
+
+    @conditional(order_list_validator)
     def get(self, request):
-        orders = Order.objects.filter(user=request.user)
+        if wants_stream(request):
+            return StreamingJSONResponse(
+                iterate_chunks(Order.objects.filter(user=request.user), prefetch=[items_prefetch()]),
+                lambda chunk: OrderSerializer(chunk, many=True).data,
+            )
+        orders = Order.objects.filter(user=request.user).prefetch_related(items_prefetch())
         serializer = OrderSerializer(orders, many=True)
         return Response(serializer.data)
 
     def post(self, request):
         serializer = OrderSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save()
+            order = serializer.save()
+            prefetch_related_objects([order], items_prefetch())
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class OrderHistoryView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # Newest first, served from the (user, created_at) index and the line
+        # snapshots; the product table isn't touched.
+        paginator = KeysetPagination(orderings={'created_at': ('created_at', 'id')}, default_ordering='-created_at')
+        orders = paginator.paginate_queryset(Order.objects.filter(user=request.user), request)
+        prefetch_related_objects(orders, 'lines')
+        serializer = OrderHistorySerializer(orders, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
 class OrderDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @conditional(order_validator)
     def get(self, request, id):
-        order = Order.objects.get(id=id)
+        order = Order.objects.prefetch_related(items_prefetch()).get(id=id)
         serializer = OrderSerializer(order)
         return Response(serializer.data)
 
@@ -281,7 +478,56 @@ class OrderDetailView(APIView):
         order = Order.objects.get(id=id)
         serializer = OrderSerializer(order, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            order = serializer.save()
+            prefetch_related_objects([order], items_prefetch())
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class SellerSalesView(APIView):
+    permission_classes = [IsAuthenticated, IsSeller]
+    default_days = 30
+
+    def get_range(self, request):
+        try:
+            end = date.fromisoformat(request.query_params['to']) if 'to' in request.query_params else timezone.now().date()
+            start = date.fromisoformat(request.query_params['from']) if 'from' in request.query_params else end - timedelta(days=self.default_days - 1)
+        except ValueError:
+            raise ValidationError({'detail': 'Dates must be YYYY-MM-DD.'})
+        if start > end:
+            raise ValidationError({'detail': '"from" must not be after "to".'})
+        return start, end
+
+    def get(self, request):
+        # Reads the rollup tables only, never orders or lines.
+        start, end = self.get_range(request)
+        days = SellerSalesDaily.objects.filter(seller=request.user, day__range=(start, end)).order_by('day')
+        days = list(days.values('day', 'units', 'revenue', 'orders'))
+        products = (
+            ProductSalesDaily.objects.filter(seller=request.user, day__range=(start, end))
+            .values('product_id').annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+            .order_by('-revenue', 'product_id')[:20]
+        )
+        return Response({
+            'from': start,
+            'to': end,
+            'totals': {
+                'units': sum(day['units'] for day in days),
+                'revenue': sum((day['revenue'] for day in days), Decimal('0.00')),
+                'orders': sum(day['orders'] for day in days),
+            },
+            'days': days,
+            'top_products': list(products),
+        })
+
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({'catalog': catalog_cache.stats(), 'users': user_cache.stats(), 'token_blacklist': blacklist_filter.stats()})
+
+class MetricsView(APIView):
+    # Prometheus text format, summed over every worker of the deployment.
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
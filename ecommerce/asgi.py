@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
+os.environ.setdefault('ECOMMERCE_ASYNC_READ_PATH', '1')
 
-application = get_asgi_application()
+# What get_asgi_application() does, with a handler that produces streamed
+# bodies off the event loop.
+django.setup(set_prefix=False)
+
+from core.async_views import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
@@ -0,0 +1,209 @@
+import functools
+import os
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+from ecommerce.metrics import LATENCY_BUCKETS, registry
+
+DEFAULTS = {
+    'MAX_SIZE': 10,
+    # Recycle connections older than this, so server-side timeouts, failovers
+    # and DNS changes are picked up.
+    'MAX_LIFETIME': 1800,
+    # Ping a connection before handing it out if it sat idle this long.
+    'PRE_PING_AFTER': 5,
+    # How long to wait for a free connection once MAX_SIZE are checked out.
+    'TIMEOUT': 10,
+}
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of raw DB-API connections to one database, shared by the
+    threads of one process. Idle connections are reused newest first, so a
+    quiet process lets the rest age out.
+    """
+    def __init__(self, name, ping, close, max_size, max_lifetime, pre_ping_after, timeout):
+        self.name = name
+        self.ping = ping
+        self.close = close
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.pre_ping_after = pre_ping_after
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.in_use = {}
+        self.size = 0
+        self.created = 0
+        self.closed = {'lifetime': 0, 'ping': 0, 'discarded': 0}
+        self.timeouts = 0
+
+    def discard(self, connection, reason):
+        try:
+            self.close(connection)
+        except Exception:
+            pass
+        with self.condition:
+            self.size -= 1
+            self.closed[reason] += 1
+            self.condition.notify()
+
+    def checkout(self):
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while not self.idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout('No connection to %s became free within %ss.' % (self.name, self.timeout))
+                self.condition.wait(remaining)
+            if self.idle:
+                return self.idle.pop()
+            # Reserve the slot now; the connection is opened outside the lock.
+            self.size += 1
+            return None
+
+    def acquire(self, connect):
+        start = time.monotonic()
+        entry = self.checkout()
+        registry.observe('db_pool_wait_seconds', {'database': self.name}, time.monotonic() - start)
+        while entry is not None:
+            connection, created_at, released_at = entry
+            now = time.monotonic()
+            if now - created_at > self.max_lifetime:
+                self.discard(connection, 'lifetime')
+            elif now - released_at > self.pre_ping_after and not self.is_alive(connection):
+                self.discard(connection, 'ping')
+            else:
+                with self.condition:
+                    self.in_use[id(connection)] = created_at
+                return connection
+            entry = self.checkout()
+        try:
+            connection = connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.created += 1
+            self.in_use[id(connection)] = time.monotonic()
+        return connection
+
+    def is_alive(self, connection):
+        try:
+            self.ping(connection)
+            return True
+        except Exception:
+            return False
+
+    def release(self, connection, discard=False):
+        with self.condition:
+            created_at = self.in_use.pop(id(connection), None)
+        if created_at is None:
+            # Not one of ours (opened before the pool existed, or forked).
+            self.close(connection)
+            return
+        if discard:
+            self.discard(connection, 'discarded')
+        elif time.monotonic() - created_at > self.max_lifetime:
+            self.discard(connection, 'lifetime')
+        else:
+            with self.condition:
+                self.idle.append((connection, created_at, time.monotonic()))
+                self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'idle': len(self.idle),
+                'in_use': len(self.in_use),
+                'created': self.created,
+                'closed': dict(self.closed),
+                'timeouts': self.timeouts,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, name, options, ping, close):
+    # Keyed by process too: a forked worker must never reuse its parent's
+    # sockets.
+    key = (os.getpid(),) + key
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = dict(DEFAULTS, **options)
+            pool = _pools[key] = ConnectionPool(
+                name, ping, close, options['MAX_SIZE'], options['MAX_LIFETIME'],
+                options['PRE_PING_AFTER'], options['TIMEOUT'],
+            )
+        return pool
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Takes connections from a per-process pool instead of opening them, and
+    returns them on close. Pooling is configured by a POOL dict in the
+    database's settings (see DEFAULTS); 'POOL': False turns it off.
+
+    Leave CONN_MAX_AGE at 0 so Django hands each connection back after
+    every request; the pool is what keeps it open.
+    """
+    def ping_connection(self, connection):
+        raise NotImplementedError
+
+    def get_pool(self):
+        options = self.settings_dict.get('POOL', {})
+        if options is False:
+            return None
+        settings_dict = self.settings_dict
+        key = (self.alias, settings_dict['NAME'], settings_dict['HOST'], settings_dict['PORT'], settings_dict['USER'])
+        return get_pool(key, self.alias, options, self.ping_connection, lambda connection: connection.close())
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool()
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        return pool.acquire(functools.partial(super().get_new_connection, conn_params))
+
+    def _close(self):
+        pool = self.get_pool()
+        if pool is None or self.connection is None:
+            return super()._close()
+        # A connection in the middle of a transaction, or one that raised,
+        # is closed rather than handed to the next request.
+        pool.release(self.connection, discard=self.in_atomic_block or self.errors_occurred or not self.autocommit)
+
+
+def collect_pool_metrics():
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if key[0] == os.getpid()]
+    for pool in pools:
+        stats = pool.stats()
+        labels = {'database': pool.name}
+        yield 'db_pool_connections', dict(labels, state='idle'), stats['idle']
+        yield 'db_pool_connections', dict(labels, state='in_use'), stats['in_use']
+        yield 'db_pool_connections_created_total', labels, stats['created']
+        for reason, count in stats['closed'].items():
+            yield 'db_pool_connections_closed_total', dict(labels, reason=reason), count
+        yield 'db_pool_timeouts_total', labels, stats['timeouts']
+
+
+registry.describe('db_pool_wait_seconds', 'histogram', 'Time spent waiting for a pooled connection.', LATENCY_BUCKETS)
+registry.describe('db_pool_connections', 'gauge', 'Pooled connections by state.')
+registry.describe('db_pool_connections_created_total', 'counter', 'Connections opened by the pool.')
+registry.describe('db_pool_connections_closed_total', 'counter', 'Pooled connections closed, by reason.')
+registry.describe('db_pool_timeouts_total', 'counter', 'Checkouts that gave up waiting for a free connection.')
+registry.register_collector(collect_pool_metrics)
@@ -0,0 +1,14 @@
+from django.db.backends.sqlite3 import base
+
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def ping_connection(self, connection):
+        connection.execute('SELECT 1')
+
+    def get_pool(self):
+        # Each connection to an in-memory database is a database of its own.
+        if self.is_in_memory_db():
+            return None
+        return super().get_pool()
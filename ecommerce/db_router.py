@@ -0,0 +1,182 @@
+"""
+Read-replica routing.
+
+ReplicaRoutingMiddleware marks safe requests to the routes listed in
+DATABASE_REPLICAS['READ_ROUTES']; ReplicaRouter sends the reads those
+requests make to a replica. Everything else (writes, reads inside a
+transaction, management commands, the admin) stays on the primary.
+
+A user who just made a write is pinned to the primary for STICKY_SECONDS so
+they read their own writes, and replicas more than MAX_LAG seconds behind,
+or unreachable, are skipped until the next lag check. Reads that fill a
+shared cache go to the primary (see read_from_primary()), so a lagging
+replica's rows are never cached for every worker to serve.
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .metrics import registry
+
+DEFAULTS = {
+    'ALIASES': [],
+    'READ_ROUTES': [],
+    'STICKY_SECONDS': 5,
+    'MAX_LAG': 2,
+    'LAG_CHECK_INTERVAL': 5,
+    'CACHE_ALIAS': 'default',
+}
+
+
+def get_option(name):
+    return getattr(settings, 'DATABASE_REPLICAS', {}).get(name, DEFAULTS[name])
+
+
+def sticky_key(user_id):
+    return 'db_sticky:%s' % user_id
+
+
+def pin_to_primary(user_id):
+    caches[get_option('CACHE_ALIAS')].set(sticky_key(user_id), 1, get_option('STICKY_SECONDS'))
+
+
+def is_pinned(user_id):
+    return caches[get_option('CACHE_ALIAS')].get(sticky_key(user_id)) is not None
+
+
+class ReplicaMonitor:
+    """
+    Per-process view of replica lag, measured at most once per
+    LAG_CHECK_INTERVAL for each replica.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checked_at = {}
+        self.lags = {}
+        self.reads = {}
+
+    def lag(self, alias):
+        """
+        Seconds `alias` is behind the primary, or None if it isn't replicating.
+        """
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute('SHOW SLAVE STATUS')
+                row = cursor.fetchone()
+                if row is None:
+                    # Not a replica at all, e.g. a second name for the primary.
+                    return 0
+                return dict(zip([column[0] for column in cursor.description], row))['Seconds_Behind_Master']
+            if connection.vendor == 'postgresql':
+                # An idle primary sends nothing to replay, which isn't lag.
+                cursor.execute(
+                    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+                    'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+                )
+                return cursor.fetchone()[0]
+        return 0
+
+    def usable(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            if now - self.checked_at.get(alias, float('-inf')) < get_option('LAG_CHECK_INTERVAL'):
+                lag = self.lags.get(alias)
+                return lag is not None and lag <= get_option('MAX_LAG')
+            self.checked_at[alias] = now
+        try:
+            lag = self.lag(alias)
+        except DatabaseError:
+            lag = None
+        self.lags[alias] = lag
+        return lag is not None and lag <= get_option('MAX_LAG')
+
+    def choose(self):
+        aliases = [alias for alias in get_option('ALIASES') if self.usable(alias)]
+        return random.choice(aliases) if aliases else None
+
+    def count(self, target):
+        with self._lock:
+            self.reads[target] = self.reads.get(target, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {'reads': dict(self.reads), 'lags': dict(self.lags)}
+
+
+replica_monitor = ReplicaMonitor()
+
+
+class ReadRoute:
+    """
+    The replica decision for one request, made on its first read so the
+    cache and lag lookups happen off the event loop under ASGI.
+    """
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.decided = False
+        self.alias = None
+
+    def resolve(self):
+        if not self.decided:
+            if self.user_id is not None and is_pinned(self.user_id):
+                target = 'sticky'
+            else:
+                self.alias = replica_monitor.choose()
+                target = 'replica' if self.alias else 'lagging'
+            replica_monitor.count(target)
+            self.decided = True
+        return self.alias
+
+
+current_read_route = contextvars.ContextVar('current_read_route', default=None)
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Send the reads made inside the block to the primary, even on a routed
+    request.
+    """
+    token = current_read_route.set(None)
+    try:
+        yield
+    finally:
+        current_read_route.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        route = current_read_route.get()
+        if route is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return route.resolve()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+
+def collect_replica_metrics():
+    stats = replica_monitor.stats()
+    for target, count in stats['reads'].items():
+        yield 'db_routed_requests_total', {'target': target}, count
+    for alias, lag in stats['lags'].items():
+        yield 'db_replica_lag_seconds', {'database': alias}, -1 if lag is None else lag
+
+
+registry.describe('db_routed_requests_total', 'counter', 'Replica-eligible requests, by where their reads went.')
+registry.describe('db_replica_lag_seconds', 'gauge', 'Last measured replica lag; -1 when the replica was unreachable.')
+registry.register_collector(collect_replica_metrics)
@@ -0,0 +1,228 @@
+import atexit
+import contextvars
+import glob
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+DEFAULTS = {
+    # Directory shared by all worker processes of one deployment. Each worker
+    # writes its own snapshot there and /metrics sums them. When unset, only
+    # the serving process is reported.
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_MULTIPROCESS_DIR'),
+    'FLUSH_INTERVAL': 5,
+}
+
+SNAPSHOT_RE = re.compile(r'metrics_(\d+)\.json$')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def get_option(name):
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+class Registry:
+    """
+    Counters and fixed-bucket histograms for the current process.
+
+    Samples are keyed by (metric name, sorted label pairs). Collectors add
+    values owned by other modules (cache hit counters, pool stats) when a
+    snapshot is taken.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics = {}
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.last_flush = time.monotonic()
+        self.written = None
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self.metrics[name] = {'type': kind, 'help': help_text, 'buckets': buckets}
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self.metrics[name]['buckets']
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, list(labels), list(counts), total] for (name, labels), (counts, total) in self.histograms.items()]
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                counters.append([name, sorted(labels.items()), value])
+        return {'counters': counters, 'histograms': histograms}
+
+    def snapshot_path(self, directory):
+        return os.path.join(directory, 'metrics_%d.json' % os.getpid())
+
+    def flush(self, force=False):
+        directory = get_option('MULTIPROCESS_DIR')
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_flush < get_option('FLUSH_INTERVAL'):
+            return
+        self.last_flush = now
+        path = self.snapshot_path(directory)
+        tmp_path = '%s.tmp' % path
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+        if self.written is None:
+            atexit.register(self.remove_snapshot)
+        self.written = path
+
+    def remove_snapshot(self):
+        # A worker that exits takes its snapshot with it.
+        if self.written is not None:
+            try:
+                os.remove(self.written)
+            except FileNotFoundError:
+                pass
+
+    def collect(self):
+        directory = get_option('MULTIPROCESS_DIR')
+        if not directory:
+            return [self.snapshot()]
+        self.flush(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+            match = SNAPSHOT_RE.search(path)
+            if match and not pid_alive(int(match.group(1))):
+                # Left behind by a worker that was killed before it could
+                # remove it.
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        counters = {}
+        histograms = {}
+        for snapshot in self.collect():
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, counts, total in snapshot['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+
+        lines = []
+        for name in sorted({key[0] for key in counters} | {key[0] for key in histograms}):
+            metric = self.metrics.get(name, {'type': 'counter', 'help': name, 'buckets': None})
+            lines.append('# HELP %s %s' % (name, metric['help']))
+            lines.append('# TYPE %s %s' % (name, metric['type']))
+            for key in sorted(key for key in counters if key[0] == name):
+                lines.append('%s%s %s' % (name, format_labels(key[1]), format_value(counters[key])))
+            for key in sorted(key for key in histograms if key[0] == name):
+                counts, total = histograms[key]
+                cumulative = 0
+                for bound, count in zip(list(metric['buckets']) + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, format_labels(key[1] + (('le', str(bound)),)), cumulative))
+                lines.append('%s_sum%s %s' % (name, format_labels(key[1]), format_value(total)))
+                lines.append('%s_count%s %d' % (name, format_labels(key[1]), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels)
+    return '{%s}' % ','.join(escaped)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+registry.describe('http_requests_total', 'counter', 'HTTP responses by route, method and status.')
+registry.describe('http_request_duration_seconds', 'histogram', 'Time spent handling requests.', LATENCY_BUCKETS)
+registry.describe('http_request_db_queries', 'histogram', 'Database queries per request.', QUERY_COUNT_BUCKETS)
+registry.describe('http_request_db_duration_seconds', 'histogram', 'Database time per request.', LATENCY_BUCKETS)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_duration')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_duration = 0.0
+
+
+current_request_stats = contextvars.ContextVar('current_request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_duration += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def observe_request(request, response, duration, stats):
+    match = getattr(request, 'resolver_match', None)
+    # Unmatched paths share one label so scanners can't blow up cardinality.
+    route = match.route if match is not None else 'unmatched'
+    labels = {'route': route, 'method': request.method}
+    registry.inc('http_requests_total', dict(labels, status=str(response.status_code)))
+    registry.observe('http_request_duration_seconds', labels, duration)
+    registry.observe('http_request_db_queries', labels, stats.queries)
+    registry.observe('http_request_db_duration_seconds', labels, stats.db_duration)
+    registry.flush()
@@ -1,9 +1,144 @@
-class PrintHeadersMiddleware:
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from .db_router import ReadRoute, current_read_route, get_option, pin_to_primary
+from .metrics import RequestStats, current_request_stats, observe_request
+
+
+class AsyncCapableMixin:
+    """
+    Lets one of our middlewares run natively under ASGI instead of having
+    its hooks pushed onto Django's thread-sensitive executor.
+
+    That executor is one thread per process in Django 3.2. The stock
+    middlewares in MIDDLEWARE (CORS, common, security, sessions, CSRF, auth,
+    messages, clickjacking) are MiddlewareMixin subclasses and still go
+    through it, so every ASGI request queues there once per hook; only the
+    view bodies of core.async_views run side by side.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def mark_async(self, get_response):
+        if asyncio.iscoroutinefunction(get_response):
+            # The same marker django.utils.deprecation.MiddlewareMixin uses.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+class MetricsMiddleware(AsyncCapableMixin):
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.mark_async(get_response)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request_stats.reset(token)
+        observe_request(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request_stats.reset(token)
+        observe_request(request, response, time.perf_counter() - start, stats)
+        return response
+
+
+class WhiteNoiseMiddleware(AsyncCapableMixin, BaseWhiteNoiseMiddleware):
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.mark_async(get_response)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        # Without autorefresh the lookup is a dict access, safe on the loop.
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+
+class ReplicaRoutingMiddleware(AsyncCapableMixin):
+    """
+    Lets safe requests to DATABASE_REPLICAS['READ_ROUTES'] read from a
+    replica, and pins whoever makes a write to the primary for a while.
+    """
     def __init__(self, get_response):
         self.get_response = get_response
+        self.mark_async(get_response)
+        self.authentication = JWTAuthentication()
+
+    def token_user_id(self, request):
+        # Only the token is checked, without loading the user.
+        header = self.authentication.get_header(request)
+        raw_token = self.authentication.get_raw_token(header) if header else None
+        if raw_token is None:
+            return None
+        try:
+            return self.authentication.get_validated_token(raw_token).get(api_settings.USER_ID_CLAIM)
+        except InvalidToken:
+            return None
+
+    def read_route(self, request):
+        if request.method not in SAFE_METHODS or not get_option('ALIASES'):
+            return None
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+        if url_name not in get_option('READ_ROUTES'):
+            return None
+        return ReadRoute(self.token_user_id(request))
+
+    def writer_id(self, request):
+        if request.method in SAFE_METHODS or not get_option('ALIASES'):
+            return None
+        return self.token_user_id(request)
 
     def __call__(self, request):
-        response = self.get_response(request)
-        print("Request Headers:", request.headers)
-        print("Response Headers:", response.headers)
-        return response
\ No newline at end of file
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = current_read_route.set(self.read_route(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            current_read_route.reset(token)
+        user_id = self.writer_id(request)
+        if user_id is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        token = current_read_route.set(self.read_route(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_read_route.reset(token)
+        user_id = self.writer_id(request)
+        if user_id is not None:
+            await sync_to_async(pin_to_primary, thread_sensitive=False)(user_id)
+        return response
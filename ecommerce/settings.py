@@ -24,11 +24,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ecommerce.middleware.MetricsMiddleware',
+    'ecommerce.middleware.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',  
     'django.middleware.common.CommonMiddleware',
-    'ecommerce.middleware.PrintHeadersMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'ecommerce.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -56,17 +57,49 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'ecommerce.wsgi.application'
 
+# Connections come from a bounded per-process pool (ecommerce.db_backends)
+# and go back to it after each request, so CONN_MAX_AGE stays 0. Under ASGI
+# MAX_SIZE should cover ASYNC_ORM_WORKERS plus the thread running writes.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'ecommerce.db_backends.mysql',
         'NAME': 'savanna',
         'USER': 'sam',
         'PASSWORD': 'wayne',
         'HOST': 'localhost',
         'PORT': '3306',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+            'MAX_LIFETIME': 1800,
+            'PRE_PING_AFTER': 5,
+            'TIMEOUT': 10,
+        },
     }
 }
 
+# Read replicas, e.g. ECOMMERCE_DB_REPLICAS=db-replica-1,db-replica-2.
+DATABASES.update(
+    ('replica%d' % index, dict(DATABASES['default'], HOST=host.strip()))
+    for index, host in enumerate(filter(None, os.environ.get('ECOMMERCE_DB_REPLICAS', '').split(',')), 1)
+)
+
+DATABASE_ROUTERS = ['ecommerce.db_router.ReplicaRouter']
+
+# Safe requests to READ_ROUTES read from ALIASES. A user who writes reads
+# from the primary for STICKY_SECONDS (tracked in CACHE_ALIAS, so it must be
+# shared between workers), and replicas more than MAX_LAG seconds behind are
+# skipped; lag is measured every LAG_CHECK_INTERVAL seconds per process.
+# Catalog cache misses are filled from the primary either way.
+DATABASE_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'READ_ROUTES': ['product-list', 'product-detail', 'product-search', 'order-history'],
+    'STICKY_SECONDS': 5,
+    'MAX_LAG': 2,
+    'LAG_CHECK_INTERVAL': 5,
+    'CACHE_ALIAS': 'default',
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -100,6 +133,9 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Widths of the WebP/JPEG derivatives generated for Product.image.
+PRODUCT_IMAGE_SIZES = (128, 512, 1024)
+
 CORS_ALLOW_ALL_ORIGINS = True
 
 # CORS_ALLOWED_ORIGINS = [
@@ -132,7 +168,7 @@ CORS_ALLOW_METHODS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -167,3 +203,71 @@ SIMPLE_JWT = {
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Shared by every worker process, e.g. ECOMMERCE_CACHE_LOCATION=cache-1:11211,cache-2:11211.
+# The catalog cache keeps its version stamps here; with a process-local
+# backend such as LocMemCache it caches nothing rather than let workers serve
+# entries another worker has invalidated.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': os.environ.get('ECOMMERCE_CACHE_LOCATION', '127.0.0.1:11211').split(','),
+    }
+}
+
+CATALOG_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+    'LOCAL_MAX_ENTRIES': 1024,
+}
+
+# Users resolved from access tokens. Each worker keeps its own copies and
+# checks a per-user version stamp in CACHE_ALIAS on every request, so it
+# must be shared between workers; with a process-local cache every request
+# loads its user.
+AUTH_USER_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'MAX_ENTRIES': 10000,
+    'TTL': 60,
+}
+
+# Bloom filter in front of the refresh token blacklist; its version counter
+# lives in CACHE_ALIAS, which must be shared between workers. With a
+# process-local cache every refresh checks the blacklist table instead.
+TOKEN_BLACKLIST_FILTER = {
+    'CACHE_ALIAS': 'default',
+    'ERROR_RATE': 0.001,
+    'REBUILD_INTERVAL': 600,
+}
+
+STOCK_RESERVATION_TTL = timedelta(minutes=15)
+
+# Post-checkout work sets this estimate on each new order.
+ORDER_DELIVERY_ESTIMATE = timedelta(days=3)
+
+# Background jobs, run by `manage.py run_jobs`. A failed job is retried up
+# to MAX_ATTEMPTS times with exponential backoff; a job whose worker stopped
+# for LEASE seconds is handed to another worker. Finished jobs, and with
+# them their idempotency keys, are purged after RETENTION.
+JOBS = {
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 10,
+    'BACKOFF_MAX': 3600,
+    'LEASE': 600,
+    'RETENTION': timedelta(days=7),
+}
+
+# Under ASGI the catalog and cart reads run on a bounded thread pool instead
+# of Django's thread-sensitive executor, a single thread that serializes
+# every view it runs. The stock middlewares' hooks still run on that thread.
+ASYNC_READ_PATH = os.environ.get('ECOMMERCE_ASYNC_READ_PATH') == '1'
+ASYNC_ORM_WORKERS = int(os.environ.get('ASYNC_ORM_WORKERS', 16))
+
+METRICS = {
+    # Shared by all gunicorn workers so /metrics covers the whole deployment.
+    # Workers remove their own snapshot on exit; /metrics removes those of
+    # workers that died. The endpoint is for admins, so scrape it with an
+    # admin's access token.
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_MULTIPROCESS_DIR'),
+    'FLUSH_INTERVAL': 5,
+}
@@ -0,0 +1,36 @@
+"""
+Settings for running the tests on two local SQLite files standing in for
+the primary and a read replica:
+
+    python manage.py test --settings=ecommerce.test_settings
+
+Nothing replicates between them, so tests can tell which one a read used.
+Replica routing is off unless a test turns on READ_ROUTES. The cache is
+file-based: shared like memcached, without needing a server.
+"""
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASE_REPLICAS
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'ecommerce.db_backends.sqlite3',
+        'NAME': BASE_DIR / 'primary.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_primary.sqlite3'},
+    },
+    'replica': {
+        'ENGINE': 'ecommerce.db_backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_replica.sqlite3'},
+    },
+}
+
+DATABASE_REPLICAS = dict(DATABASE_REPLICAS, ALIASES=['replica'], READ_ROUTES=[])
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': tempfile.mkdtemp(prefix='ecommerce-test-cache-'),
+    }
+}
@@ -20,21 +20,42 @@ from core import views
 from django.conf import settings
 from django.conf.urls.static import static
 
+if settings.ASYNC_READ_PATH:
+    from core import async_views
+    product_list = async_views.product_list
+    product_search = async_views.product_search
+    product_detail = async_views.product_detail
+    cart = async_views.cart
+else:
+    product_list = views.ProductListView.as_view()
+    product_search = views.ProductSearchView.as_view()
+    product_detail = views.ProductDetailView.as_view()
+    cart = views.CartView.as_view()
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
     path('api/auth/register/', views.RegisterView.as_view(), name='register'),
     path('api/auth/login/', views.LoginView.as_view(), name='login'),
+    path('api/auth/refresh/', views.TokenRefreshView.as_view(), name='token-refresh'),
     path('api/auth/logout/', views.LogoutView.as_view(), name='logout'),
     path('api/auth/profile/', views.ProfileView.as_view(), name='profile'),
-    path('api/products/', views.ProductListView.as_view(), name='product-list'),
-    path('api/products/<int:id>/', views.ProductDetailView.as_view(), name='product-detail'),
-    path('api/cart/', views.CartView.as_view(), name='cart'),
+    path('api/products/', product_list, name='product-list'),
+    path('api/products/import/', views.ProductImportView.as_view(), name='product-import'),
+    path('api/products/export/', views.ProductExportView.as_view(), name='product-export'),
+    path('api/products/search/', product_search, name='product-search'),
+    path('api/products/<int:id>/', product_detail, name='product-detail'),
+    path('api/cart/', cart, name='cart'),
     path('api/cart/add/', views.AddToCartView.as_view(), name='add-to-cart'),
+    path('api/cart/batch/', views.CartBatchView.as_view(), name='cart-batch'),
     path('api/cart/update/', views.UpdateCartItemView.as_view(), name='update-cart-item'),
     path('api/cart/remove/', views.RemoveFromCartView.as_view(), name='remove-from-cart'),
     path('api/cart/remove/<int:product_id>/', views.CartItemDeleteView.as_view(), name='cart-item-remove'),
     path('api/orders/', views.OrderListView.as_view(), name='order-list'),
+    path('api/orders/history/', views.OrderHistoryView.as_view(), name='order-history'),
     path('api/orders/<int:id>/', views.OrderDetailView.as_view(), name='order-detail'),
+    path('api/seller/sales/', views.SellerSalesView.as_view(), name='seller-sales'),
+    path('api/cache/stats/', views.CacheStatsView.as_view(), name='cache-stats'),
 ]
 
 if settings.DEBUG: